@@ -0,0 +1,70 @@
+"""
+Per-call overhead of robot_args: the old interpretive parsing against the compiled parsers.
+
+    python bench/bench_robot_args.py
+"""
+import sys
+from os.path import abspath, dirname
+from timeit import repeat
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from impl._params import parse, parse_bool, parse_positional, parse_named2, robot_args
+
+# The same shape as pywinauto_core.LAUNCH_PARAMS and CLICK_BUTTON_PARAMS
+LAUNCH_PARAMS = (
+    (parse,), {
+       'teardown': ('teardown', parse),
+       'assert': ('_assert', parse_bool),
+       'params': ('params', parse),
+       'workdir': ('workdir', parse),
+       'failure_text': ('failure_text', parse),
+       'backend': ('backend', parse),
+    }
+)
+CLICK_BUTTON_PARAMS = (
+    (parse,), {
+       'title': ('title', parse),
+       'title_re': ('title_re', parse),
+       'control_id': ('control_id', parse),
+       'auto_id': ('auto_id', parse),
+    }
+)
+LONG_PARAMS = (tuple([parse] * 8 + [parse_bool] * 8), {})
+
+
+def old_robot_args(pdescr):
+    pos, d = pdescr
+    def decorator(f):
+        def callable(*a, **kw):
+            params = list(a)
+            fixed = parse_positional(pos, params)
+            named = parse_named2(d, kw)
+            return f(*fixed, **named)
+        return callable
+    return decorator
+
+
+def keyword(*a, **kw):
+    pass
+
+
+CASES = (
+    ('launch', LAUNCH_PARAMS, ('calc.exe',), {'teardown': 'test', 'assert': 'yes', 'backend': 'uia'}),
+    ('click_button', CLICK_BUTTON_PARAMS, ('window',), {'title': 'OK'}),
+    ('16 positional', LONG_PARAMS, tuple(['v'] * 8 + ['yes'] * 8), {}),
+)
+
+
+def run(number=100000):
+    print('%-16s %12s %12s %8s' % ('case', 'old, us', 'compiled, us', 'speedup'))
+    for name, descr, a, kw in CASES:
+        old = old_robot_args(descr)(keyword)
+        new = robot_args(descr)(keyword)
+        t_old = min(repeat(lambda: old(*a, **kw), number=number, repeat=3)) / number * 1e6
+        t_new = min(repeat(lambda: new(*a, **kw), number=number, repeat=3)) / number * 1e6
+        print('%-16s %12.3f %12.3f %7.2fx' % (name, t_old, t_new, t_old / t_new))
+
+
+if __name__ == '__main__':
+    run()
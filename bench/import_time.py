@@ -0,0 +1,80 @@
+"""
+Where the library load time goes.
+
+    python bench/import_time.py [module ...] [--top 20] [--json]
+
+Imports the modules (bot by default) in a fresh interpreter with -X importtime and prints the total and the
+modules that cost most by their own (self) time, with their cumulative time and who imported them first.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def parse_importtime(text):
+    """
+    (module, self us, cumulative us, importing module) tuples in the import order.
+
+    >>> text = '''import time: self [us] | cumulative | imported package
+    ... import time:       100 |        100 |     json.decoder
+    ... import time:       300 |        400 |   json
+    ... import time:        50 |        450 | bot'''
+    >>> parse_importtime(text)
+    [('json.decoder', 100, 100, 'json'), ('json', 300, 400, 'bot'), ('bot', 50, 450, None)]
+    """
+    rows = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    res = []
+    for i, (name, own, cumulative, depth) in enumerate(rows):
+        parent = next((r[0] for r in rows[i + 1:] if r[3] < depth), None)     # Printed after its children
+        res.append((name, own, cumulative, parent))
+    return res
+
+
+def measure(modules):
+    code = '; '.join('import %s' % m for m in modules)
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, stderr=subprocess.PIPE,
+                       stdout=subprocess.DEVNULL, universal_newlines=True)
+    if p.returncode:
+        raise SystemExit(p.stderr)
+    return parse_importtime(p.stderr)
+
+
+def report(rows, modules, top):
+    roots = dict((name, cumulative) for name, _, cumulative, parent in rows if parent is None)
+    lines = ['Total: %.1f ms' % (sum(roots.get(m, 0) for m in modules) / 1000.0),
+             '%10s %10s  %-40s %s' % ('self ms', 'cumul ms', 'module', 'imported by')]
+    for name, own, cumulative, parent in sorted(rows, key=lambda r: -r[1])[:top]:
+        lines.append('%10.2f %10.2f  %-40s %s' % (own / 1000.0, cumulative / 1000.0, name, parent or '-'))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Library import time report')
+    p.add_argument('modules', nargs='*', default=['bot'])
+    p.add_argument('--top', type=int, default=20)
+    p.add_argument('--json', action='store_true', help='print all the rows as JSON')
+    args = p.parse_args(argv)
+    rows = measure(args.modules)
+    if args.json:
+        print(json.dumps([dict(zip(('module', 'self_us', 'cumulative_us', 'imported_by'), r)) for r in rows],
+                         indent=1))
+    else:
+        print(report(rows, args.modules, args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
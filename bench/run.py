@@ -0,0 +1,205 @@
+"""
+Benchmarks of the keyword layer hot paths, each in isolation.
+
+    python bench/run.py [--output results.json] [--baseline baseline.json [--threshold 0.25]] [--save-baseline]
+
+Prints the results as JSON (microseconds per operation, the best of several repeats). With --baseline the
+results are compared with a stored run and the exit code is 1 if any path is slower than the baseline by more
+than the threshold (a fraction, 0.25 = 25%). --save-baseline writes the results into the baseline file instead.
+"""
+import argparse
+import json
+import platform
+import sys
+from os.path import abspath, dirname
+from time import perf_counter
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from impl import _util
+from impl._backend import set_backend
+from impl._fake_backend import FakeBackend
+from impl._params import parse, robot_args
+from impl._util import Delay, Monitoring, ErrorMonitor, result_modifier, stream_result_modifier, waiting_iterator
+from impl._waiter import Waiter
+
+CASES = []
+
+
+def case(number):
+    """
+    Registers a benchmark: `setup()` returns the function to time, or (that function, a cleanup function).
+    """
+    def decorator(setup):
+        CASES.append((setup.__name__, number, setup))
+        return setup
+    return decorator
+
+
+class NoSleepWaiter(Waiter):
+    def sleep(self, seconds):
+        return 0.0, False
+
+
+@case(20000)
+def delay_parse():
+    benchmark, Delay.BENCHMARK = Delay.BENCHMARK, 2.0
+
+    def run():
+        Delay('~10s')
+        Delay(' 250ms ')
+        Delay('forever')
+
+    def cleanup():
+        Delay.BENCHMARK = benchmark
+    return run, cleanup
+
+
+@case(50000)
+def robot_args_dispatch():
+    @robot_args(((parse,), {'title': ('title', parse), 'title_re': ('title_re', parse),
+                            'control_id': ('control_id', parse), 'auto_id': ('auto_id', parse)}))
+    def keyword(window, title=None, title_re=None, control_id=None, auto_id=None):
+        pass
+    return lambda: keyword('window', title='OK')
+
+
+@case(200)
+def result_modifier_1000():
+    items = [0] * 999 + [1]
+    return lambda: result_modifier(items, single=True)
+
+
+@case(2000)
+def stream_result_modifier_1000():
+    items = [1] * 1000
+    return lambda: stream_result_modifier(iter(items), any=True)
+
+
+@case(200)
+def waiting_iterator_100_ticks():
+    waiter = NoSleepWaiter()
+    forever = Delay('forever')
+    def run():
+        for i, _ in enumerate(waiting_iterator(forever, waiter)):
+            if i == 99:
+                break
+    return run
+
+
+@case(50000)
+def check_monitors_12():
+    """
+    12 stand-in monitor children beating on the heartbeat board: a check scans all their slots.
+    """
+    from time import monotonic, sleep
+    from impl import _standin_monitor
+    script, ErrorMonitor.script = ErrorMonitor.script, _standin_monitor.__file__
+    m = Monitoring()
+    _util.set_monitoring(None)
+
+    def cleanup():
+        m.kill_monitors()
+        ErrorMonitor.script = script
+    for i in range(12):
+        m.add_monitor('suite.robot', 'ok')
+    t0 = monotonic()
+    while any(r is None or r[2] == 0 for r in m.board.read()):     # Until all of them have beaten
+        if monotonic() - t0 > 30:
+            cleanup()
+            raise RuntimeError('The stand-in monitors have not started')
+        sleep(0.01)
+    return m.check_monitors, cleanup
+
+
+@case(5000)
+def click_button_fake():
+    import pywinauto_core
+    set_backend(FakeBackend())
+    window = pywinauto_core.wnd_get(pywinauto_core.get_backend().start('calc.exe'), 'Calculator')
+    return lambda: pywinauto_core.click_button(window, auto_id='equalButton')
+
+
+@case(2000)
+def find_all_title_re_fake():
+    b = FakeBackend()
+    window = b.window(b.start('calc.exe'), 'Calculator')
+    return lambda: b.find_all(window, title_re='[0-9]$', control_type='Button')
+
+
+def measure(run, number, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = perf_counter()
+        for _ in range(number):
+            run()
+        t = (perf_counter() - t0) / number
+        if best is None or t < best:
+            best = t
+    return best * 1e6
+
+
+def run_cases(names=None, repeat=5):
+    results = {}
+    for name, number, setup in CASES:
+        if names and name not in names:
+            continue
+        run = setup()
+        run, cleanup = run if isinstance(run, tuple) else (run, None)
+        try:
+            results[name] = {'us_per_op': round(measure(run, number, repeat), 4), 'number': number}
+        finally:
+            if cleanup is not None:
+                cleanup()
+    set_backend(None)
+    return {'python': platform.python_version(), 'host': platform.node(), 'cases': results}
+
+
+def compare(results, baseline, threshold):
+    """
+    >>> compare({'cases': {'a': {'us_per_op': 1.3}, 'b': {'us_per_op': 1.0}, 'c': {'us_per_op': 5}}},
+    ...         {'cases': {'a': {'us_per_op': 1.0}, 'b': {'us_per_op': 1.0}}}, 0.25)
+    [('a', 1.0, 1.3)]
+    """
+    regressions = []
+    for name, r in sorted(results['cases'].items()):
+        b = baseline['cases'].get(name)
+        if b and r['us_per_op'] > b['us_per_op'] * (1 + threshold):
+            regressions.append((name, b['us_per_op'], r['us_per_op']))
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Keyword layer benchmarks')
+    p.add_argument('cases', nargs='*', help='cases to run (all by default): %s' % ', '.join(c[0] for c in CASES))
+    p.add_argument('--output', help='also write the results into this file')
+    p.add_argument('--baseline', help='a JSON file with a stored run to compare with')
+    p.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    p.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, a fraction (default 0.25)')
+    p.add_argument('--repeat', type=int, default=5)
+    args = p.parse_args(argv)
+    if args.save_baseline and not args.baseline:
+        p.error('--save-baseline needs --baseline <file> to write to')
+
+    results = run_cases(args.cases, args.repeat)
+    text = json.dumps(results, indent=1, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if not args.baseline:
+        return 0
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for name, was, now in regressions:
+        sys.stderr.write('REGRESSION %s: %.3f us -> %.3f us (+%.0f%%)\n' % (name, was, now, (now / was - 1) * 100))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 from pywinauto_core import app_launch
+from impl import _history, _profile, _trace
 
 ROBOT_LIBRARY_SCOPE = 'GLOBAL'
 
@@ -7,33 +8,63 @@ class _Listener:
     ROBOT_LISTENER_API_VERSION = 2
 
     def __init__(self):
-        pass
+        _trace.start_from_env()
+        _profile.start_from_env()
 
     def start_suite(self, name, attrs):
+        if _trace.TRACER:
+            _trace.TRACER.begin(name, 'suite', {'source': attrs.get('source')})
+        _history.enter('suite', attrs.get('longname', name))
         from pywinauto_core import on_enter_suite
         on_enter_suite()
         from logging import warning
         warning("START SUITE %s" % name)
 
     def start_test(self, name, attrs):
+        if _trace.TRACER:
+            _trace.TRACER.begin(name, 'test', {'tags': attrs.get('tags')})
+        _history.enter('test', name)
         from pywinauto_core import on_enter_test
         on_enter_test()
+        if _profile.PROFILER:
+            _profile.PROFILER.start_test(name, attrs)
+
+    def start_keyword(self, name, attrs):
+        if _trace.TRACER:
+            _trace.TRACER.begin(name, 'keyword')
+        _history.enter('keyword', name)
+
+    def end_keyword(self, name, attrs):
+        _history.leave('keyword')
+        if _trace.TRACER:
+            _trace.TRACER.end({'status': attrs.get('status')})
 
     def end_test(self, name, attrs):
         import logging
+        if _profile.PROFILER:
+            path = _profile.PROFILER.end_test()
+            if path:
+                logging.info('Profile of %s: %s' % (name, path))
         from pywinauto_core import on_leave_test
         on_leave_test()
+        _history.leave('test')
+        if _trace.TRACER:
+            _trace.TRACER.end({'status': attrs.get('status')})
 
     def end_suite(self, name, attrs):
         from pywinauto_core import on_leave_suite
         on_leave_suite()
+        _history.leave('suite')
         from logging import warning
         warning("END SUITE %s" % name)
+        if _trace.TRACER:
+            _trace.TRACER.end({'status': attrs.get('status')})
+            _trace.TRACER.flush()
 
     def close(self):
-        pass
+        _trace.stop_tracing()
 
 
 ROBOT_LIBRARY_LISTENER = _Listener()
 
-del _Listener
\ No newline at end of file
+del _Listener
@@ -0,0 +1,66 @@
+"""
+The thin client of the keyword agent: load it in Robot instead of bot.py to run the keywords in a long-lived
+agent process (python -m impl._agent, started on the first keyword call when none is running at
+$TRANSAS_UIA_AGENT). The agent keeps the calibration, the imported backend and the app and window connections
+between the runs. Importing the library (libdoc, --dryrun) starts nothing.
+"""
+from impl._agent import LISTENER_METHODS, keywords, spawn
+import pywinauto_core
+
+ROBOT_LIBRARY_SCOPE = 'GLOBAL'
+
+CLIENT = None
+PENDING = []        # Listener events of the scopes open before the agent was started
+
+
+def _client():
+    global CLIENT
+    if CLIENT is None:
+        CLIENT = spawn()
+        for method, args in PENDING:
+            CLIENT.listen(method, *args)
+        del PENDING[:]
+    return CLIENT
+
+
+def _keyword(name, doc):
+    def keyword(*args, **kwargs):
+        return _client().call(name, *args, **kwargs)
+    keyword.__name__ = name
+    keyword.__doc__ = doc
+    return keyword
+
+
+for _name, _f in keywords(pywinauto_core).items():
+    globals()[_name] = _keyword(_name, _f.__doc__)
+
+
+def _listen(method, *args):
+    """
+    Passes a listener event to the agent. Until it runs, only the start events of the open scopes are kept,
+    to be replayed when it starts.
+    """
+    if CLIENT is not None:
+        CLIENT.listen(method, *args)
+    elif method.startswith('start_'):
+        PENDING.append((method, args))
+    elif method.startswith('end_') and PENDING and PENDING[-1][0] == 'start_' + method[4:]:
+        PENDING.pop()
+    elif method == 'close':
+        del PENDING[:]
+
+
+class _Listener:
+    ROBOT_LISTENER_API_VERSION = 2
+
+
+def _forward(method):
+    return lambda self, *args: _listen(method, *args)
+
+
+for _method in LISTENER_METHODS:
+    setattr(_Listener, _method, _forward(_method))
+
+ROBOT_LIBRARY_LISTENER = _Listener()
+
+del _Listener, _name, _f, _method
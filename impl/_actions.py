@@ -0,0 +1,66 @@
+from impl._params import IronbotParametersException, pop_menu_path
+
+LOCATOR_KEYS = ('title', 'title_re', 'control_id', 'auto_id')
+ACTION_ARGS = {
+    'click': 1,
+    'type': 2,
+}
+
+
+def parse_locator(token):
+    """
+    >>> parse_locator('auto_id=okButton')
+    {'auto_id': 'okButton'}
+    >>> parse_locator('title=a=b')
+    {'title': 'a=b'}
+    >>> try: parse_locator('name=OK')
+    ... except IronbotParametersException as e: print(e)
+    Expected a locator (title=, title_re=, control_id= or auto_id=), got 'name=OK'
+    """
+    key, sep, value = token.partition('=')
+    key = key.strip()
+    if not sep or key not in LOCATOR_KEYS:
+        raise IronbotParametersException('Expected a locator (%s= or %s=), got %r' % (
+            '=, '.join(LOCATOR_KEYS[:-1]), LOCATOR_KEYS[-1], token))
+    return {key: value}
+
+
+def parse_actions(tokens):
+    """
+    Parses a compact action script into a list of (action, locator or menu path, text) steps:
+
+        click | <locator>
+        type | <locator> | <text>
+        menu | <item> | <item> ... | <END>
+
+    A locator is one of title=..., title_re=..., control_id=..., auto_id=...
+
+    >>> parse_actions(['click', 'auto_id=ok', 'menu', 'File', 'Open', '<END>', 'type', 'title=Name', 'Bob'])
+    [('click', {'auto_id': 'ok'}, None), ('menu', ['File', 'Open'], None), ('type', {'title': 'Name'}, 'Bob')]
+    >>> parse_actions([['click', 'title=OK']])
+    [('click', {'title': 'OK'}, None)]
+    >>> try: parse_actions(['click', 'title=OK', 'drag', 'title=A'])
+    ... except IronbotParametersException as e: print(e)
+    Step 1: unknown action 'drag', expected one of: click, menu, type
+    >>> try: parse_actions(['type', 'title=Name'])
+    ... except IronbotParametersException as e: print(e)
+    Step 0: 'type' expects 2 parameter(s)
+    """
+    if len(tokens) == 1 and isinstance(tokens[0], (list, tuple)):
+        tokens = tokens[0]
+    tokens = list(tokens)
+    steps = []
+    while tokens:
+        action = tokens.pop(0).strip().lower()
+        if action == 'menu':
+            steps.append(('menu', pop_menu_path(tokens), None))
+            continue
+        n = ACTION_ARGS.get(action)
+        if n is None:
+            raise IronbotParametersException('Step %d: unknown action %r, expected one of: %s' % (
+                len(steps), action, ', '.join(sorted(list(ACTION_ARGS) + ['menu']))))
+        if len(tokens) < n:
+            raise IronbotParametersException("Step %d: '%s' expects %d parameter(s)" % (len(steps), action, n))
+        args, tokens = tokens[:n], tokens[n:]
+        steps.append((action, parse_locator(args[0]), args[1] if n > 1 else None))
+    return steps
@@ -0,0 +1,496 @@
+import hmac
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import weakref
+from itertools import count
+from os.path import expanduser, join
+
+DEFAULT_ADDRESS = os.environ.get('TRANSAS_UIA_AGENT', '127.0.0.1:8271')
+TOKEN_FILE = os.environ.get('TRANSAS_UIA_AGENT_TOKEN', join(expanduser('~'), '.transas_uia', 'agent.token'))
+HEADER = struct.Struct('>I')
+MAX_FRAME = 64 << 20
+REF = '\0ref'         # Key of the dictionary standing for a remote object
+TUPLE = '\0tuple'     # Key of the dictionary standing for a tuple (JSON has lists only)
+HOOKS = ('on_enter_suite', 'on_enter_test', 'on_leave_test', 'on_leave_suite')
+LISTENER_METHODS = ('start_suite', 'start_test', 'start_keyword', 'end_keyword', 'end_test', 'end_suite', 'close')
+PLAIN = (type(None), bool, int, float, str)
+RELEASE_BATCH = 32
+
+
+class AgentError(Exception):
+    """
+    A keyword has failed in the agent: `type` is the name of the exception raised there.
+    """
+
+    def __init__(self, type, message):
+        Exception.__init__(self, message)
+        self.type = type
+
+
+def parse_address(address):
+    """
+    >>> parse_address('127.0.0.1:8271'), parse_address(':9000')
+    (('127.0.0.1', 8271), ('127.0.0.1', 9000))
+    """
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def load_token(path=None):
+    """
+    The secret a client must present to the agent: read from a file only the user can read, created with
+    a random token the first time.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'sub', 'agent.token')
+    >>> t = load_token(path)
+    >>> len(t), load_token(path) == t
+    (64, True)
+    >>> os.name != 'posix' or oct(os.stat(path).st_mode & 0o777)
+    '0o600'
+    """
+    import secrets
+    path = path or TOKEN_FILE
+    d = os.path.dirname(path)
+    if d and not os.path.isdir(d):
+        os.makedirs(d, 0o700, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        if os.name == 'posix' and os.stat(path).st_mode & 0o077:
+            raise AgentError('PermissionError', 'The agent token %s is readable by other users' % path)
+        with open(path) as f:
+            return f.read().strip()
+    token = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    return token
+
+
+def _pack(v):
+    if isinstance(v, tuple):
+        return {TUPLE: [_pack(x) for x in v]}
+    if isinstance(v, list):
+        return [_pack(x) for x in v]
+    if isinstance(v, dict):
+        return dict((k, _pack(x)) for k, x in v.items())
+    return v
+
+
+def _unpack(v):
+    if isinstance(v, list):
+        return [_unpack(x) for x in v]
+    if isinstance(v, dict):
+        if TUPLE in v:
+            return tuple(_unpack(x) for x in v[TUPLE])
+        return dict((k, _unpack(x)) for k, x in v.items())
+    return v
+
+
+def send(sock, msg):
+    """
+    A frame: the length, then the message as JSON (tuples kept as such).
+    """
+    data = json.dumps(_pack(msg), separators=(',', ':')).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _read(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise EOFError('Connection closed')
+        buf += chunk
+    return bytes(buf)
+
+
+def receive(sock):
+    n, = HEADER.unpack(_read(sock, HEADER.size))
+    if n > MAX_FRAME:
+        raise EOFError('Frame too large: %d bytes' % n)
+    try:
+        return _unpack(json.loads(_read(sock, n).decode('utf-8')))
+    except ValueError as e:
+        raise EOFError('Bad frame: %s' % e)
+
+
+def keywords(module):
+    """
+    The keywords of a library module: its own public functions, except for the listener hooks.
+    """
+    return dict((name, f) for name, f in vars(module).items()
+                if not name.startswith('_') and name not in HOOKS and callable(f) and not isinstance(f, type)
+                and getattr(f, '__module__', None) == module.__name__)
+
+
+class AgentServer(object):
+    """
+    Serves the keywords of a library module over a local TCP socket. A connection starts with ('hello',
+    token), the token of load_token(): the agent runs programs for its clients, so only the user owning it may
+    connect. Requests are then JSON tuples (op, name, args, kwargs), one frame each, on a connection reused for
+    the whole run; the calls are serialized, as the keywords share their state. Values JSON cannot carry (apps,
+    windows, reports) stay in the agent and are sent as references, valid while the connection lives or until
+    released. Only public attributes of them can be read. Listener events are passed on to `listener`.
+
+    >>> import pywinauto_core
+    >>> from impl._backend import set_backend
+    >>> _ = set_backend('fake')
+    >>> import tempfile
+    >>> token_file = os.path.join(tempfile.mkdtemp(), 'agent.token')
+    >>> server = AgentServer(pywinauto_core, ('127.0.0.1', 0), token_file=token_file)
+    >>> server.start()
+    >>> try: AgentClient(server.address, token='forged').keywords()
+    ... except AgentError as e: print(e)
+    Bad agent token
+    >>> c = AgentClient(server.address, token=load_token(token_file))
+    >>> c.call('on_enter_suite'), c.call('on_enter_test')
+    (None, None)
+    >>> app = c.call('app_launch', 'calc.exe', teardown='test')
+    >>> w = c.call('wnd_get', app, 'Calculator')
+    >>> w, c.call('wnd_get', w, 'Number pad')
+    (<remote FakeSpec 2>, <remote FakeSpec 3>)
+    >>> c.call('click_button', w, title='7')
+    >>> report = c.call('verify_control', w, auto_id='num7Button', single='yes')
+    >>> report.clicks
+    1
+    >>> try: c.request('getattr', '__class__', (report,))
+    ... except AgentError as e: print(e.type, e)
+    AttributeError Private attribute '__class__'
+    >>> try: c.call('click_button', w, title='nope')
+    ... except AgentError as e: print(e.type, e)
+    FakeElementNotFound No element matches {'title': 'nope', 'control_type': 'Button'}
+    >>> try: c.call('on_leave_suite_')
+    ... except AgentError as e: print(e)
+    Unknown keyword 'on_leave_suite_'
+    >>> refs = server.references
+    >>> del report
+    >>> c.listen('end_test', 'T', {})
+    >>> server.references < refs
+    True
+    >>> c.call('on_leave_test'), c.call('on_leave_suite')
+    (None, None)
+    >>> 'click_button' in c.keywords(), 'on_leave_test' in c.keywords()
+    (True, False)
+    >>> c.close()
+    >>> server.stop()
+    >>> _ = set_backend(None)
+    """
+
+    def __init__(self, module, address=None, listener=None, token_file=None):
+        self.module = module
+        self.listener = listener
+        self.token = load_token(token_file)
+        self.callables = keywords(module)
+        self.callables.update((name, getattr(module, name)) for name in HOOKS if hasattr(module, name))
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if hasattr(socket, 'SO_EXCLUSIVEADDRUSE'):    # Windows: no other process may bind the port too
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(address or parse_address(DEFAULT_ADDRESS))
+        self._sock.listen(8)
+        self.address = self._sock.getsockname()
+        self._thread = None
+        self._stopping = False
+        self.references = 0     # Objects held for the clients
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='agent', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def serve_forever(self):
+        while not self._stopping:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(conn,), name='agent-conn', daemon=True).start()
+
+    def _serve(self, conn):
+        refs = {}
+        known = {}          # id() of a referenced object -> its reference
+        ids = count(1)
+
+        def encode(v):
+            if isinstance(v, PLAIN):
+                return v
+            if isinstance(v, (list, tuple)):
+                return type(v)(encode(x) for x in v)
+            if isinstance(v, dict) and all(isinstance(k, str) for k in v):
+                return dict((k, encode(x)) for k, x in v.items())
+            i = known.get(id(v))
+            if i is None:
+                i = known[id(v)] = next(ids)
+                refs[i] = v
+                self.references += 1
+            return {REF: i, 'type': type(v).__name__}
+
+        def decode(v):
+            if isinstance(v, (list, tuple)):
+                return type(v)(decode(x) for x in v)
+            if isinstance(v, dict):
+                if REF in v:
+                    return refs[v[REF]]
+                return dict((k, decode(x)) for k, x in v.items())
+            return v
+
+        with conn:
+            try:
+                hello = receive(conn)
+                ok = (isinstance(hello, tuple) and len(hello) == 2 and hello[0] == 'hello'
+                      and isinstance(hello[1], str) and hmac.compare_digest(hello[1], self.token))
+                send(conn, ('ok', None) if ok else ('error', 'PermissionError', 'Bad agent token'))
+            except (EOFError, OSError):
+                return
+            if not ok:
+                return
+            while True:
+                try:
+                    op, name, args, kwargs = receive(conn)
+                except (EOFError, OSError, TypeError, ValueError):
+                    break
+                try:
+                    if op == 'call':
+                        f = self.callables.get(name)
+                        if f is None:
+                            raise AgentError('KeyError', "Unknown keyword '%s'" % name)
+                        with self._lock:
+                            res = f(*decode(args), **decode(kwargs))
+                    elif op == 'listen':
+                        if name not in LISTENER_METHODS:
+                            raise AgentError('ValueError', "Unknown listener method '%s'" % name)
+                        res = None
+                        if self.listener is not None:
+                            with self._lock:
+                                getattr(self.listener, name)(*args)
+                    elif op == 'getattr':
+                        if not isinstance(name, str) or name.startswith('_'):
+                            raise AgentError('AttributeError', 'Private attribute %r' % (name,))
+                        res = getattr(decode(args[0]), name)
+                    elif op == 'release':
+                        for i in args:
+                            if i in refs:
+                                known.pop(id(refs.pop(i)), None)
+                                self.references -= 1
+                        res = None
+                    elif op == 'keywords':
+                        res = dict((n, f.__doc__ or '') for n, f in self.callables.items() if n not in HOOKS)
+                    else:
+                        raise AgentError('ValueError', "Unknown operation '%s'" % op)
+                    reply = ('ok', encode(res))
+                except Exception as e:
+                    reply = ('error', e.type if isinstance(e, AgentError) else type(e).__name__, str(e))
+                try:
+                    send(conn, reply)
+                except OSError:
+                    break
+            self.references -= len(refs)
+
+
+class Remote(object):
+    """
+    An object living in the agent. Its attributes are fetched from there. The agent is told to drop the
+    object once its Remote is garbage collected.
+    """
+    __slots__ = ('_client', '_id', '_type', '__weakref__')
+
+    def __init__(self, client, id, type):
+        self._client = client
+        self._id = id
+        self._type = type
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._client.request('getattr', name, (self,), {})
+
+    def __repr__(self):
+        return '<remote %s %d>' % (self._type, self._id)
+
+
+class AgentClient(object):
+    """
+    A connection to an AgentServer, opened on the first call and reused for all the next ones.
+    """
+
+    def __init__(self, address=None, token=None):
+        self.address = address or parse_address(DEFAULT_ADDRESS)
+        self.token = token
+        self._sock = None
+        self._lock = threading.Lock()
+        self._remotes = weakref.WeakValueDictionary()
+        self._released = set()      # Ids of the collected Remotes, released in batches
+
+    def _connect(self):
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.token is None:
+            self.token = load_token()
+        try:
+            send(sock, ('hello', self.token))
+            reply = receive(sock)
+        except (EOFError, OSError):
+            sock.close()
+            raise
+        if reply[0] == 'error':
+            sock.close()
+            raise AgentError(reply[1], reply[2])
+        return sock
+
+    def _encode(self, v):
+        if isinstance(v, Remote):
+            return {REF: v._id}
+        if isinstance(v, (list, tuple)):
+            return type(v)(self._encode(x) for x in v)
+        if isinstance(v, dict):
+            return dict((k, self._encode(x)) for k, x in v.items())
+        return v
+
+    def _decode(self, v):
+        if isinstance(v, (list, tuple)):
+            return type(v)(self._decode(x) for x in v)
+        if isinstance(v, dict):
+            if REF in v:
+                return self._remote(v[REF], v['type'])
+            return dict((k, self._decode(x)) for k, x in v.items())
+        return v
+
+    def _remote(self, i, type):
+        """
+        The one Remote of a reference. A reference sent again before its release has gone out stays.
+        """
+        r = self._remotes.get(i)
+        if r is None:
+            self._released.discard(i)
+            r = self._remotes[i] = Remote(self, i, type)
+            weakref.finalize(r, self._released.add, i)
+        return r
+
+    def _release(self, force=False):
+        """
+        Sends the pending releases: when RELEASE_BATCH of them have gathered, or all of them with `force`.
+        Called with the lock held.
+        """
+        if self._sock is None or not self._released or (not force and len(self._released) < RELEASE_BATCH):
+            return
+        ids = list(self._released)
+        self._released.difference_update(ids)
+        send(self._sock, ('release', None, ids, {}))
+        receive(self._sock)
+
+    def request(self, op, name=None, args=(), kwargs=None):
+        with self._lock:
+            if self._sock is None:
+                self._sock = self._connect()
+            try:
+                self._release(op == 'listen' and name in ('end_test', 'end_suite'))
+                send(self._sock, (op, name, self._encode(tuple(args)), self._encode(kwargs or {})))
+                reply = receive(self._sock)
+            except (EOFError, OSError) as e:
+                self.close()      # The next call reconnects, e.g. to a restarted agent
+                raise ConnectionError('Lost the connection to the agent: %s' % e)
+        if reply[0] == 'error':
+            raise AgentError(reply[1], reply[2])
+        return self._decode(reply[1])
+
+    def call(self, name, *args, **kwargs):
+        return self.request('call', name, args, kwargs)
+
+    def keywords(self):
+        """
+        Names of the keywords the agent serves, mapped to their documentation.
+        """
+        return self.request('keywords')
+
+    def listen(self, method, *args):
+        self.request('listen', method, args)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._released.clear()      # The references of a closed connection are gone already
+        self._remotes.clear()
+
+
+def spawn(address=None, timeout=30.0, backend=None):
+    """
+    Starts an agent in the background, unless one is already serving at the address. Returns a client
+    connected to it.
+    """
+    from time import monotonic, sleep
+    import subprocess
+    client = AgentClient(address)
+    try:
+        client.request('keywords')
+        return client
+    except OSError:
+        pass
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cmd = [sys.executable, '-m', 'impl._agent', '%s:%d' % client.address]
+    if backend:
+        cmd += ['--backend', backend]
+    flags = getattr(subprocess, 'DETACHED_PROCESS', 0) | getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)
+    subprocess.Popen(cmd, cwd=root, creationflags=flags, start_new_session=not flags,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = monotonic() + timeout
+    while True:
+        try:
+            client.request('keywords')
+            return client
+        except OSError:
+            client.close()
+            if monotonic() > deadline:
+                raise AgentError('TimeoutError', 'The agent has not started on %s:%d' % client.address)
+            sleep(0.1)
+
+
+def main(argv):
+    """
+    python -m impl._agent [<host>:<port>] [--backend fake]
+
+    Runs the agent in the foreground, calibrated and with the backend imported once for all the runs. The
+    events of bot_agent's listener go to bot's one.
+    """
+    backend = None
+    if '--backend' in argv:
+        i = argv.index('--backend')
+        backend = argv[i + 1]
+        del argv[i:i + 2]
+    if backend:
+        os.environ['TRANSAS_UIA_BACKEND'] = backend
+    import bot
+    import pywinauto_core
+    from impl._backend import get_backend
+    from impl._util import Delay
+    Delay.do_benchmarking()
+    get_backend()
+    server = AgentServer(pywinauto_core, parse_address(argv[0]) if argv else None, bot.ROBOT_LIBRARY_LISTENER)
+    logging.warning('Serving %d keywords on %s:%d' % ((len(server.callables),) + server.address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    main(sys.argv[1:])
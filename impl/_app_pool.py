@@ -0,0 +1,131 @@
+import logging
+from time import monotonic
+
+from impl._parallel import parallel_map
+
+
+class AppPool(object):
+    """
+    Instances of one app launched up front and handed out to the tests one at a time. `launch()` starts an
+    instance, `alive(app)` tells whether it still runs, `reset(app)` brings a used instance back to a known
+    state (raising when it cannot) and `discard(app)` gets rid of a dead or broken one. A used instance is
+    reset when it is acquired again, an instance failing the reset is recycled: discarded, a fresh one is
+    launched when the pool runs short.
+
+    >>> n = [0]
+    >>> def launch():
+    ...     n[0] += 1
+    ...     return {'id': n[0], 'alive': True, 'state': 'clean'}
+    >>> def reset(app):
+    ...     if app['id'] == 2:
+    ...         raise RuntimeError('stuck dialog')
+    ...     app['state'] = 'clean'
+    >>> discarded = []
+    >>> pool = AppPool(launch, 2, reset, alive=lambda a: a['alive'], discard=discarded.append)
+    >>> pool.fill()
+    2
+    >>> a, b = pool.acquire(), pool.acquire()
+    >>> a['id'], b['id'], pool.acquire()['id']
+    (1, 2, 3)
+    >>> a['state'] = b['state'] = 'dirty'
+    >>> pool.release(a); pool.release(b)
+    >>> pool.acquire()['state']
+    'clean'
+    >>> pool.acquire()['id'], [d['id'] for d in discarded]
+    (4, [2])
+    >>> s = pool.stats()
+    >>> s['hits'], s['misses'], s['recycled'], s['launches'], s['hit_rate']
+    (3, 2, 1, 4, 0.6)
+    >>> [a['id'] for a in pool.close()], pool.apps
+    ([1, 3, 4], [])
+    """
+
+    def __init__(self, launch, size=1, reset=None, alive=None, discard=None, max_workers=None):
+        self.launch = launch
+        self.size = size
+        self.reset = reset
+        self.alive = alive or (lambda app: True)
+        self.discard = discard or (lambda app: None)
+        self.max_workers = max_workers
+        self.apps = []
+        self._idle = []          # (app, used) pairs, the oldest first
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self.launches = 0
+        self.launch_time = 0.0
+
+    def _timed_launch(self):
+        t0 = monotonic()
+        app = self.launch()
+        return app, monotonic() - t0
+
+    def _add(self, app, seconds):
+        self.launches += 1
+        self.launch_time += seconds
+        self.apps.append(app)
+        return app
+
+    def fill(self):
+        """
+        Launches the instances missing up to `size` concurrently. Returns the number of the instances started.
+        """
+        missing = self.size - len(self._idle)
+        results = parallel_map(lambda _: self._timed_launch(), range(max(missing, 0)), self.max_workers)
+        for res, e in results:
+            if e is not None:
+                logging.warning('App pool: failed to launch an instance: %s' % e)
+            else:
+                self._idle.append((self._add(*res), False))
+        return sum(1 for _, e in results if e is None)
+
+    def _recycle(self, app, reason):
+        logging.warning('App pool: recycling an instance (%s)' % reason)
+        self.recycled += 1
+        if app in self.apps:
+            self.apps.remove(app)
+        self.discard(app)
+
+    def acquire(self):
+        """
+        An idle instance (reset if it has been used), or a newly launched one when there is none.
+        """
+        while self._idle:
+            app, used = self._idle.pop(0)
+            if not self.alive(app):
+                self._recycle(app, 'not running')
+                continue
+            if used and self.reset is not None:
+                try:
+                    self.reset(app)
+                except Exception as e:
+                    self._recycle(app, 'reset failed: %s' % e)
+                    continue
+            self.hits += 1
+            return app
+        self.misses += 1
+        return self._add(*self._timed_launch())
+
+    def release(self, app):
+        if self.alive(app):
+            self._idle.append((app, True))
+        else:
+            self._recycle(app, 'not running')
+
+    def stats(self):
+        """
+        'hit_rate' is the share of the acquisitions served without a launch, 'saved' estimates the seconds
+        those would have taken to launch.
+        """
+        total = self.hits + self.misses
+        mean = self.launch_time / self.launches if self.launches else 0.0
+        return {'hits': self.hits, 'misses': self.misses, 'recycled': self.recycled, 'launches': self.launches,
+                'idle': len(self._idle), 'hit_rate': self.hits / total if total else 0.0,
+                'launch_time': self.launch_time, 'saved': self.hits * mean}
+
+    def close(self):
+        """
+        Forgets all the instances. Returns them, for the teardown.
+        """
+        apps, self.apps, self._idle = self.apps, [], []
+        return apps
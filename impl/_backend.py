@@ -0,0 +1,273 @@
+import os
+
+from impl._locator import compile_locator, compile_pattern
+
+
+class BackendException(Exception):
+    pass
+
+
+class Backend(object):
+    """
+    What the keywords need from a UI automation engine. `backend` arguments are the engine's own
+    flavour (e.g. 'uia' or 'win32' for pywinauto), None for its default.
+    """
+
+    def start(self, executable, backend=None):
+        raise NotImplementedError
+
+    def connect(self, process, backend=None):
+        raise NotImplementedError
+
+    def window(self, parent, name):
+        raise NotImplementedError
+
+    def find(self, window, **criteria):
+        raise NotImplementedError
+
+    def find_all(self, window, **criteria):
+        """
+        All the resolved descendants of the window matching the criteria.
+        """
+        raise NotImplementedError
+
+    def enabled(self, element):
+        return element.is_enabled()
+
+    def click(self, element):
+        element.click()
+
+    def type_text(self, element, text):
+        raise NotImplementedError
+
+    def select_menu(self, window, path):
+        """
+        Selects a menu item of the window by the list of item titles leading to it.
+        """
+        raise NotImplementedError
+
+    def handle(self, window):
+        """
+        A hashable identity of an app, a window specification or a resolved element, stable while it lives
+        and computed without looking anything up.
+        """
+        raise NotImplementedError
+
+    def resolve(self, spec):
+        """
+        Turns a lazy specification returned by window()/find() into the element itself.
+        """
+        return spec
+
+    def alive(self, element):
+        """
+        Whether a resolved element still exists, visible or not, as cheap as possible.
+        """
+        return True
+
+    def visible(self, element):
+        return element.is_visible()
+
+    def children(self, element):
+        raise NotImplementedError
+
+    def key(self, element):
+        """
+        A hashable identity of a resolved element.
+        """
+        raise NotImplementedError
+
+    def properties(self, element):
+        """
+        (key, title, control_type, auto_id, control_id) of a resolved element, as used by snapshots.
+        """
+        raise NotImplementedError
+
+
+SEARCH_CONDITIONS = ('title', 'control_type')    # What element_info.descendants() filters on by itself
+INFO_PROPERTIES = {'title': 'name', 'auto_id': 'automation_id', 'control_type': 'control_type',
+                   'control_id': 'control_id'}
+
+
+def _hashable(v):
+    try:
+        hash(v)
+        return v
+    except TypeError:
+        return repr(v)
+
+
+def _title_re_predicate(criteria):
+    """
+    pywinauto criteria with title_re turned into a predicate_func matching the cached compiled pattern,
+    instead of a regex compiled by pywinauto on every search.
+    """
+    title_re = criteria.get('title_re')
+    if title_re is None:
+        return criteria
+    match = compile_pattern(title_re).match
+    criteria = dict(criteria)
+    del criteria['title_re']
+    criteria['predicate_func'] = lambda el: match(_element_name(el) or '') is not None
+    return criteria
+
+
+def _element_name(el):
+    info = getattr(el, 'element_info', el)
+    return info.name
+
+
+def _info_property(info, field):
+    """
+    A property of a pywinauto element_info, read only when a locator check needs it (each read may be a
+    cross-process call).
+    """
+    return getattr(info, INFO_PROPERTIES[field], None)
+
+
+class PywinautoBackend(Backend):
+    def __init__(self):
+        from pywinauto.application import Application, WindowSpecification
+        self.Application = Application
+        self.WindowSpecification = WindowSpecification
+
+    def _application(self, backend):
+        if backend is not None:
+            return self.Application(backend=backend)
+        return self.Application()
+
+    def start(self, executable, backend=None):
+        return self._application(backend).start(executable)
+
+    def connect(self, process, backend=None):
+        return self._application(backend).connect(process=process)
+
+    def window(self, parent, name):
+        return parent[name]
+
+    def find(self, window, **criteria):
+        criteria = _title_re_predicate(criteria)
+        if not isinstance(window, self.WindowSpecification):
+            return self.WindowSpecification(dict(criteria, backend=window.backend.name, parent=window.element_info,
+                                                 top_level_only=False))
+        return window.window(**criteria)
+
+    def find_all(self, window, **criteria):
+        """
+        title and control_type are passed to the descendants() search (a UIA condition, evaluated in the
+        target process); title_re, auto_id and control_id are checked here on what it returns.
+        """
+        from pywinauto.backend import registry
+        compile_locator(criteria)       # Validates all of them
+        w = self.resolve(window)
+        backend = registry.backends[w.backend.name]
+        cond = dict((k, v) for k, v in criteria.items() if k in SEARCH_CONDITIONS and v is not None)
+        rest = dict((k, v) for k, v in criteria.items() if k not in cond)
+        infos = w.element_info.descendants(**cond)
+        if rest:
+            infos = compile_locator(rest).filter(infos, _info_property)
+        return [backend.generic_wrapper_class(i) for i in infos]
+
+    def type_text(self, element, text):
+        if hasattr(element, 'set_edit_text'):
+            element.set_edit_text(text)
+        else:
+            element.type_keys(text, with_spaces=True, with_newlines=True)
+
+    def select_menu(self, window, path):
+        self.resolve(window).menu_select(' -> '.join(path))
+
+    def handle(self, window):
+        if isinstance(window, self.Application):
+            return 'pid', window.process
+        if isinstance(window, self.WindowSpecification):
+            return ('spec',) + tuple(tuple(sorted((k, _hashable(v)) for k, v in c.items())) for c in window.criteria)
+        return self.key(window)
+
+    def resolve(self, spec):
+        if isinstance(spec, self.WindowSpecification):
+            return spec.wrapper_object()
+        return spec
+
+    def alive(self, element):
+        """
+        A hidden element (a collapsed pane, another tab) still exists: a window handle is asked to the system,
+        a windowless element for its process id, which fails once it is gone.
+        """
+        info = element.element_info
+        try:
+            handle = info.handle
+            if handle:
+                from pywinauto import handleprops
+                return bool(handleprops.iswindow(handle))
+            return bool(info.process_id)
+        except Exception:       # COMError, ElementNotAvailable...
+            return False
+
+    def children(self, element):
+        return element.children()
+
+    def key(self, element):
+        info = element.element_info
+        runtime_id = getattr(info, 'runtime_id', None)
+        return tuple(runtime_id) if runtime_id else info.handle
+
+    def properties(self, element):
+        info = element.element_info
+        return (self.key(element), info.name, info.control_type, getattr(info, 'automation_id', None) or None,
+                info.control_id or None)
+
+
+def _fake():
+    from impl._fake_backend import FakeBackend
+    return FakeBackend()
+
+
+def _record():
+    from impl._replay import RecordingBackend
+    return RecordingBackend(BACKENDS[os.environ.get('TRANSAS_UIA_RECORD_BACKEND', 'pywinauto')]())
+
+
+def _replay():
+    from impl._replay import ReplayBackend
+    return ReplayBackend(timing=os.environ.get('TRANSAS_UIA_REPLAY_TIMING', '') == '1',
+                         session=os.environ.get('TRANSAS_UIA_REPLAY_SESSION') or None)
+
+
+BACKENDS = {
+    'pywinauto': PywinautoBackend,
+    'fake': _fake,
+    'record': _record,
+    'replay': _replay,
+}
+DEFAULT_BACKEND = os.environ.get('TRANSAS_UIA_BACKEND', 'pywinauto')
+BACKEND = None
+
+
+def set_backend(backend):
+    """
+    Sets the backend used by the keywords: a Backend object or a name from BACKENDS.
+
+    >>> set_backend('fake').__class__.__name__
+    'FakeBackend'
+    >>> get_backend() is get_backend()
+    True
+    >>> try: set_backend('nonexistent')
+    ... except BackendException as e: print(e)
+    Unknown backend 'nonexistent', expected one of: fake, pywinauto, record, replay
+    >>> _ = set_backend(None)
+    """
+    global BACKEND
+    if isinstance(backend, str):
+        try:
+            backend = BACKENDS[backend]()
+        except KeyError:
+            raise BackendException("Unknown backend '%s', expected one of: %s" % (backend, ', '.join(sorted(BACKENDS))))
+    BACKEND = backend
+    return backend
+
+
+def get_backend():
+    if BACKEND is None:
+        set_backend(DEFAULT_BACKEND)
+    return BACKEND
@@ -0,0 +1,174 @@
+import json
+import os
+import platform
+import sys
+from contextlib import contextmanager
+from os.path import basename, dirname, expanduser, join
+from time import monotonic, time
+
+BENCHMARK_ROUNDS = 50000
+REFERENCE_TIME = 0.04       # Seconds the benchmark takes on a reference (fast) machine
+CACHE_MAX_AGE = 7 * 24 * 3600.0
+CACHE_FILE = os.environ.get('TRANSAS_UIA_CALIBRATION',
+                            join(expanduser('~'), '.transas_uia', 'calibration.json'))
+
+
+def run_benchmark(rounds=BENCHMARK_ROUNDS):
+    """
+    A fixed in-process workload (dicts, strings, lists), typical for the keyword code.
+
+    >>> run_benchmark(1000)
+    1146
+    """
+    d = {}
+    s = []
+    for i in range(rounds):
+        k = 'k%d' % (i & 255)
+        d[k] = d.get(k, 0) + i
+        s.append(k.upper())
+    return len(''.join(s[:250])) + len(d)
+
+
+def measure(repeat=3, time_f=monotonic):
+    """
+    The best of `repeat` runs of the benchmark, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        t0 = time_f()
+        run_benchmark()
+        t = time_f() - t0
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def calibration_key():
+    return '%s|%s|%s' % (platform.node(), sys.executable, platform.python_version())
+
+
+def factor_from_time(elapsed, lo, hi):
+    """
+    >>> factor_from_time(0.01, 1, 5), factor_from_time(REFERENCE_TIME * 2.5, 1, 5), factor_from_time(10, 1, 5)
+    (1, 2.5, 5)
+    """
+    return min(max(elapsed / REFERENCE_TIME, lo), hi)
+
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_cache(path, cache):
+    """
+    Writes the file atomically: through a temporary file of its own, so that concurrent writers never
+    write into each other's.
+    """
+    import tempfile
+    tmp = None
+    try:
+        d = dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=d or None, prefix=basename(path) + '.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    except (IOError, OSError):
+        import logging
+        logging.warning("Cannot save the cache to '%s'" % path)
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextmanager
+def locked(path):
+    """
+    Holds an exclusive lock on <path>.lock, taken by every process reading, merging and writing the file.
+    """
+    d = dirname(path)
+    if d and not os.path.isdir(d):
+        os.makedirs(d, exist_ok=True)
+    with open(path + '.lock', 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)     # Gives up after 10s, so retry
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+
+
+def update_cache(path, update):
+    """
+    Re-reads the file, changes it with `update(cache)` and writes it back, all under the lock, so that
+    concurrent updates are not lost. Returns the new content.
+
+    >>> import tempfile
+    >>> from threading import Thread
+    >>> path = join(tempfile.mkdtemp(), 'cache.json')
+    >>> def add(i):
+    ...     update_cache(path, lambda c: c.setdefault('items', []).append(i))
+    >>> threads = [Thread(target=add, args=(i,)) for i in range(8)]
+    >>> for t in threads: t.start()
+    >>> for t in threads: t.join()
+    >>> sorted(load_cache(path)['items']), sorted(os.listdir(dirname(path)))
+    ([0, 1, 2, 3, 4, 5, 6, 7], ['cache.json', 'cache.json.lock'])
+    """
+    try:
+        with locked(path):
+            cache = load_cache(path)
+            update(cache)
+            save_cache(path, cache)
+            return cache
+    except (IOError, OSError):
+        import logging
+        logging.warning("Cannot update the cache '%s'" % path)
+        return None
+
+
+def calibrate(lo, hi, path=None, max_age=CACHE_MAX_AGE, measure_f=measure, now_f=time):
+    """
+    Returns the scaling factor of this machine, between `lo` and `hi`. The factor is taken from the cache
+    file if it has a fresh entry for this host and interpreter, otherwise the benchmark is run and the
+    result is saved.
+
+    >>> import tempfile
+    >>> path = join(tempfile.mkdtemp(), 'calibration.json')
+    >>> calibrate(1, 5, path, measure_f=lambda: REFERENCE_TIME * 2, now_f=lambda: 1000.0)
+    2.0
+    >>> calibrate(1, 5, path, measure_f=lambda: 1 / 0, now_f=lambda: 1001.0)
+    2.0
+    >>> calibrate(1, 5, path, max_age=1, measure_f=lambda: REFERENCE_TIME * 3, now_f=lambda: 1002.0)
+    3.0
+    """
+    path = path or CACHE_FILE
+    key = calibration_key()
+    cache = load_cache(path)
+    entry = cache.get(key)
+    now = now_f()
+    if isinstance(entry, dict) and 0 <= now - entry.get('time', -max_age - 1) <= max_age:
+        try:
+            return min(max(float(entry['factor']), lo), hi)
+        except (KeyError, TypeError, ValueError):
+            pass
+    elapsed = measure_f()
+    factor = factor_from_time(elapsed, lo, hi)
+    update_cache(path, lambda c: c.update({key: {'factor': factor, 'elapsed': elapsed, 'time': now}}))
+    return factor
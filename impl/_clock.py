@@ -0,0 +1,114 @@
+import heapq
+from itertools import count
+from time import monotonic, sleep
+
+
+class RealClock(object):
+    """
+    The monotonic clock; waits block the thread.
+    """
+
+    def now(self):
+        return monotonic()
+
+    def sleep(self, seconds):
+        sleep(seconds)
+
+    def wait(self, event, timeout):
+        return event.wait(timeout)
+
+    def wait_for(self, condition, predicate, timeout):
+        """
+        The same as condition.wait_for(): must be called with the condition acquired.
+        """
+        return condition.wait_for(predicate, timeout)
+
+
+class VirtualTimeDeadlock(RuntimeError):
+    pass
+
+
+class VirtualClock(object):
+    """
+    Time that only moves when somebody sleeps or waits: the clock jumps to the end of the pause at once,
+    running the callbacks scheduled with call_at() / call_later() on the way. A wait ends early once its
+    event is set or its predicate becomes true (normally because of such a callback).
+
+    >>> c = VirtualClock()
+    >>> c.sleep(3600)
+    >>> c.now()
+    3600.0
+    >>> from threading import Event
+    >>> e = Event()
+    >>> _ = c.call_later(5, e.set)
+    >>> c.wait(e, 60), c.now()
+    (True, 3605.0)
+    >>> c.wait(Event(), 10), c.now()
+    (False, 3615.0)
+    >>> try: c.wait(Event(), None)
+    ... except VirtualTimeDeadlock as e: print(e)
+    Waiting forever in virtual time with nothing scheduled
+    """
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._timers = []
+        self._seq = count()
+
+    def now(self):
+        return self._now
+
+    def call_at(self, t, f, *a):
+        heapq.heappush(self._timers, (t, next(self._seq), f, a))
+
+    def call_later(self, delay, f, *a):
+        self.call_at(self._now + delay, f, *a)
+
+    def advance(self, seconds, until=None):
+        """
+        Moves the time forward by `seconds` (None = as long as there are callbacks), stops early when
+        until() becomes true after a callback. Returns until() (or True without it).
+        """
+        end = None if seconds is None else self._now + seconds
+        while self._timers and (end is None or self._timers[0][0] <= end):
+            t, _, f, a = heapq.heappop(self._timers)
+            self._now = max(self._now, t)
+            f(*a)
+            if until is not None and until():
+                return True
+        if end is None:
+            if until is None or until():
+                return True
+            raise VirtualTimeDeadlock('Waiting forever in virtual time with nothing scheduled')
+        self._now = max(self._now, end)
+        return until() if until is not None else True
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        return self.advance(timeout, event.is_set)
+
+    def wait_for(self, condition, predicate, timeout):
+        if predicate():
+            return True
+        return self.advance(timeout, predicate)
+
+
+CLOCK = RealClock()
+
+
+def set_clock(clock):
+    """
+    Replaces the clock used by the waiting code (waiting_iterator, waiters, monitoring finalization,
+    teardown). Returns the previous one.
+    """
+    global CLOCK
+    previous, CLOCK = CLOCK, clock
+    return previous
+
+
+def now():
+    return CLOCK.now()
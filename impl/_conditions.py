@@ -0,0 +1,122 @@
+from impl import _clock
+from impl._util import IronbotException, result_modifier, waiting_iterator
+
+
+class WaitCondition(object):
+    """
+    A named predicate for wait_until: check() returns a list of values that is matched against the
+    result_modifier flags (any, all, single, none, number, index, not_found); without flags the truth of the
+    returned value is the result. An exception raised by the check (the window is not there yet, the app is
+    busy) only means the condition is not satisfied yet: its message is the reason, and the next poll checks
+    again.
+
+    >>> WaitCondition(lambda: [0, 1], any=True).evaluate()
+    (True, [0, 1], None)
+    >>> WaitCondition(lambda: [0, 1], 'all of them', all=True).evaluate()
+    (False, [0, 1], "The result does not match 'all' flag")
+    >>> WaitCondition(lambda: 0).evaluate()
+    (False, 0, 'The condition is false')
+    >>> WaitCondition(lambda: {}['dialog']).evaluate()
+    (False, None, "KeyError: 'dialog'")
+    """
+
+    def __init__(self, check, name=None, **flags):
+        self.check = check
+        self.name = name or getattr(check, '__name__', 'condition')
+        self.flags = flags
+
+    def evaluate(self):
+        try:
+            v = self.check()
+        except Exception as e:
+            return False, None, '%s: %s' % (type(e).__name__, e)
+        if self.flags:
+            return result_modifier(v, **self.flags)
+        if v:
+            return True, v, None
+        return False, v, 'The condition is false'
+
+    def __repr__(self):
+        return 'WaitCondition(%r)' % self.name
+
+
+class WaitReport(object):
+    """
+    `settled` maps the names of the satisfied conditions to the seconds they took, `pending` maps the others to
+    the message of their last evaluation.
+    """
+
+    def __init__(self):
+        self.settled = {}
+        self.results = {}
+        self.pending = {}
+        self.elapsed = 0.0
+
+    @property
+    def slowest(self):
+        if not self.settled:
+            return None
+        return max(self.settled.items(), key=lambda kv: kv[1])
+
+    def __repr__(self):
+        return 'WaitReport(settled=%r, pending=%r, elapsed=%.3f)' % (self.settled, sorted(self.pending),
+                                                                   self.elapsed)
+
+
+def wait_until(conditions, timeout, require_all=True, waiter=None):
+    """
+    Checks all the conditions in one polling loop until all of them (or any, if not `require_all`) are
+    satisfied. A satisfied condition is not evaluated again, a failing one is retried. Raises IronbotException
+    on timeout, returns a WaitReport otherwise.
+
+    >>> from impl._util import Delay
+    >>> calls = {'a': 0, 'b': 0}
+    >>> def a():
+    ...     calls['a'] += 1
+    ...     return True
+    >>> def b():
+    ...     calls['b'] += 1
+    ...     return calls['b'] >= 3
+    >>> r = wait_until([WaitCondition(a), WaitCondition(b)], Delay('5s'))
+    >>> calls, sorted(r.settled), r.slowest[0]
+    ({'a': 1, 'b': 3}, ['a', 'b'], 'b')
+    >>> r = wait_until([WaitCondition(lambda: False, 'never'), WaitCondition(a)], Delay('5s'), require_all=False)
+    >>> sorted(r.settled), r.pending
+    (['a'], {'never': 'The condition is false'})
+    >>> try: wait_until([WaitCondition(a), WaitCondition(lambda: [], 'rows', any=True)], Delay('30ms'))
+    ... except IronbotException as e: print(e)
+    Timed out waiting for all of 2 condition(s); pending: rows (The result does not match 'any' flag)
+    >>> def flaky():
+    ...     calls['flaky'] = calls.get('flaky', 0) + 1
+    ...     if calls['flaky'] < 3:
+    ...         raise LookupError('No such window')
+    ...     return True
+    >>> sorted(wait_until([WaitCondition(flaky)], Delay('5s')).settled), calls['flaky']
+    (['flaky'], 3)
+    >>> try: wait_until([WaitCondition(lambda: 1 / 0, 'broken')], Delay('30ms'))
+    ... except IronbotException as e: print(e)
+    Timed out waiting for all of 1 condition(s); pending: broken (ZeroDivisionError: division by zero)
+    """
+    report = WaitReport()
+    now = _clock.CLOCK.now
+    t0 = now()
+    pending = list(conditions)
+    for _ in waiting_iterator(timeout, waiter):
+        still = []
+        for c in pending:
+            ok, res, msg = c.evaluate()
+            if ok:
+                report.settled[c.name] = now() - t0
+                report.results[c.name] = res
+                report.pending.pop(c.name, None)
+            else:
+                report.pending[c.name] = msg
+                still.append(c)
+        pending = still
+        if not pending or (not require_all and report.settled):
+            report.elapsed = now() - t0
+            return report
+    report.elapsed = now() - t0
+    raise IronbotException('Timed out waiting for %s of %d condition(s); pending: %s' % (
+        'all' if require_all else 'any', len(conditions),
+        ', '.join('%s (%s)' % (c.name, report.pending[c.name]) for c in pending)))
@@ -0,0 +1,331 @@
+from itertools import count
+from os.path import basename
+from time import sleep
+
+from impl._backend import Backend, BackendException
+from impl._locator import compile_locator
+
+
+class FakeElementNotFound(LookupError):
+    pass
+
+
+_HANDLES = count(0x10000)
+_PIDS = count(100000)
+
+
+class FakeControl(object):
+    """
+    A control of a simulated application.
+
+    >>> w = FakeControl('Calculator', 'Window', children=[
+    ...     FakeControl('Keypad', 'Group', children=[FakeControl('4', 'Button', auto_id='num4Button')]),
+    ...     FakeControl('Equals', 'Button', auto_id='equalButton', control_id=121)])
+    >>> [c.title for c in w.descendants()]
+    ['Keypad', '4', 'Equals']
+    >>> w.window(auto_id='num4Button', control_type='Button').click()
+    >>> w.window(title_re='Eq.*').wrapper_object().control_id
+    121
+    >>> w.window(title='Keypad')['4'].clicks, w.window(title='4').wrapper_object().clicks
+    (1, 1)
+    >>> try: w.window(title='5').click()
+    ... except FakeElementNotFound as e: print(e)
+    No element matches {'title': '5'}
+    >>> try: w['Keypad']
+    ... except TypeError as e: print('not indexable')
+    not indexable
+    """
+    __slots__ = ('title', 'control_type', 'auto_id', 'control_id', 'children', 'parent', 'app', 'handle',
+                 'enabled', 'visible', 'clicks', 'on_click', 'value')
+
+    def __init__(self, title='', control_type='Custom', auto_id=None, control_id=None, children=(), enabled=True,
+                 visible=True, on_click=None):
+        self.title = title
+        self.control_type = control_type
+        self.auto_id = auto_id
+        self.control_id = control_id
+        self.children = list(children)
+        self.parent = None
+        self.app = None
+        self.handle = next(_HANDLES)
+        self.enabled = enabled
+        self.visible = visible
+        self.clicks = 0
+        self.on_click = on_click
+        self.value = ''
+        for c in self.children:
+            c.parent = self
+
+    def _delay(self, op):
+        if self.app is not None:
+            self.app.backend.delay(op)
+
+    def descendants(self):
+        stack = list(reversed(self.children))
+        while stack:
+            c = stack.pop()
+            yield c
+            stack.extend(reversed(c.children))
+
+    def matches(self, **criteria):
+        return compile_locator(criteria).matches(self)
+
+    def exists(self):
+        c = self
+        while c.parent is not None:
+            c = c.parent
+        return c.app is None or (c.app.running and c in c.app.top)
+
+    def window(self, **criteria):
+        return FakeSpec(self.descendants, criteria, self._delay, self)
+
+    def add(self, child):
+        child.parent = self
+        self.children.append(child)
+        child.attach(self.app)
+        return child
+
+    def attach(self, app):
+        self.app = app
+        for c in self.descendants():
+            c.app = app
+
+    def remove(self):
+        if self.parent is not None:
+            self.parent.children.remove(self)
+            self.parent = None
+        elif self.app is not None and self in self.app.top:
+            self.app.top.remove(self)
+
+    def click(self):
+        self._delay('click')
+        if not self.exists():
+            raise FakeElementNotFound("The element '%s' does not exist anymore" % self.title)
+        if not self.enabled:
+            raise BackendException("The element '%s' is disabled" % self.title)
+        self.clicks += 1
+        if self.on_click:
+            self.on_click(self)
+
+    def close(self):
+        self._delay('close')
+        self.remove()
+        if self.app is not None and not self.app.top:
+            self.app.running = False
+
+    def __repr__(self):
+        return 'FakeControl(%r, %r)' % (self.title, self.control_type)
+
+
+class FakeSpec(object):
+    """
+    Resolved lazily, on every use, like a pywinauto window specification: indexing it or calling window()
+    gives the specification of a descendant, other attributes are those of the element it resolves to.
+    Resolved controls cannot be indexed, as pywinauto wrappers.
+    """
+
+    def __init__(self, candidates, criteria, delay, parent):
+        self.candidates = candidates
+        self.criteria = criteria
+        self.locator = compile_locator(criteria)
+        self.delay = delay
+        self.parent = parent
+
+    def window(self, **criteria):
+        return FakeSpec(lambda: self.wrapper_object().descendants(), criteria, self.delay, self)
+
+    def __getitem__(self, name):
+        return self.window(title=name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.wrapper_object(), name)
+
+    def wrapper_object(self):
+        self.delay('find')
+        matches = self.locator.matches
+        for c in self.candidates():
+            if matches(c):
+                return c
+        raise FakeElementNotFound('No element matches %r' % self.criteria)
+
+    def exists(self):
+        try:
+            return self.wrapper_object().exists()
+        except FakeElementNotFound:
+            return False
+
+    def click(self):
+        self.wrapper_object().click()
+
+
+class FakeApp(object):
+    """
+    A simulated application: its top level windows are built by `factory`. It stops running when the last
+    one is closed or when it is killed.
+    """
+
+    def __init__(self, backend, executable, factory):
+        self.backend = backend
+        self.executable = executable
+        self.pid = next(_PIDS)
+        self.process = None     # Not a real process, so the teardown asks is_process_running()
+        self.running = True
+        self.top = list(factory())
+        for w in self.top:
+            w.attach(self)
+
+    def windows(self):
+        return list(self.top)
+
+    def window(self, **criteria):
+        def candidates():
+            for w in self.top:
+                yield w
+                for c in w.descendants():
+                    yield c
+        return FakeSpec(candidates, criteria, self.backend.delay, self)
+
+    def __getitem__(self, name):
+        return FakeSpec(lambda: iter(self.top), {'title': name}, self.backend.delay, self)
+
+    def is_process_running(self):
+        return self.running
+
+    def kill(self, soft=False):
+        self.backend.delay('kill')
+        self.running = False
+
+    def __repr__(self):
+        return 'FakeApp(%r, pid=%d)' % (self.executable, self.pid)
+
+
+def calculator():
+    return [FakeControl('Calculator', 'Window', auto_id='CalculatorWindow', children=[
+        FakeControl('Number pad', 'Group', auto_id='NumberPad', children=[
+            FakeControl(str(i), 'Button', auto_id='num%dButton' % i, control_id=130 + i) for i in range(10)]),
+        FakeControl('Standard operators', 'Group', auto_id='StandardOperators', children=[
+            FakeControl('Plus', 'Button', auto_id='plusButton', control_id=93),
+            FakeControl('Equals', 'Button', auto_id='equalButton', control_id=121)]),
+    ])]
+
+
+class FakeBackend(Backend):
+    """
+    An in-memory backend: simulated applications with configurable control trees and injected latency.
+    `apps` maps executables to factories of the top level windows, `latency` maps operations ('start',
+    'connect', 'window', 'find', 'alive', 'children', 'properties', 'click', 'type', 'close', 'kill', or '*'
+    for any other) to seconds.
+
+    >>> b = FakeBackend(latency={'start': 0.01})
+    >>> app = b.start('C:\\\\Windows\\\\calc.exe', backend='uia')
+    >>> b.connect(app.pid) is app, b.connect('calc.exe') is app
+    (True, True)
+    >>> w = b.window(app, 'Calculator')
+    >>> b.click(b.find(w, title='4', control_type='Button'))
+    >>> w.window(auto_id='num4Button').wrapper_object().clicks, b.calls['click'], b.calls['start']
+    (1, 1, 1)
+    >>> eq = b.resolve(b.find(w, auto_id='equalButton'))
+    >>> eq.visible = False
+    >>> b.alive(eq), b.visible(eq)
+    (True, False)
+    >>> w.close()
+    >>> app.is_process_running()
+    False
+    >>> try: b.start('notepad.exe')
+    ... except BackendException as e: print(e)
+    Unknown executable 'notepad.exe'
+    """
+
+    def __init__(self, apps=None, latency=None):
+        self.apps = {'calc.exe': calculator}
+        self.apps.update(apps or {})
+        self.latency = dict(latency or {})
+        self.started = []
+        self.calls = dict.fromkeys(('start', 'connect', 'window', 'find', 'alive', 'children', 'properties', 'click',
+                                    'type', 'close', 'kill'), 0)
+
+    def register(self, executable, factory):
+        self.apps[executable] = factory
+
+    def delay(self, op):
+        self.calls[op] = self.calls.get(op, 0) + 1
+        t = self.latency.get(op, self.latency.get('*', 0))
+        if t:
+            sleep(t)
+
+    def start(self, executable, backend=None):
+        self.delay('start')
+        name = basename(executable.replace('\\', '/'))
+        factory = self.apps.get(executable, self.apps.get(name))
+        if factory is None:
+            raise BackendException("Unknown executable '%s'" % executable)
+        app = FakeApp(self, name, factory)
+        self.started.append(app)
+        return app
+
+    def connect(self, process, backend=None):
+        self.delay('connect')
+        for app in self.started:
+            if app.running and process in (app.pid, app.executable):
+                return app
+        raise BackendException("No running process '%s'" % process)
+
+    def window(self, parent, name):
+        self.delay('window')
+        return parent[name]
+
+    def find(self, window, **criteria):
+        return window.window(**criteria)
+
+    def find_all(self, window, **criteria):
+        self.delay('find')
+        return compile_locator(criteria).filter(self.resolve(window).descendants())
+
+    def enabled(self, element):
+        self.delay('properties')
+        return element.enabled
+
+    def type_text(self, element, text):
+        self.delay('type')
+        if not element.exists():
+            raise FakeElementNotFound("The element '%s' does not exist anymore" % element.title)
+        element.value = text
+
+    def select_menu(self, window, path):
+        item = window
+        for title in path:
+            item = item.window(title=title, control_type='MenuItem').wrapper_object()
+            self.click(item)
+
+    def handle(self, window):
+        if isinstance(window, FakeApp):
+            return 'pid', window.pid
+        if isinstance(window, FakeSpec):
+            return 'spec', self.handle(window.parent), window.locator.key
+        return window.handle
+
+    def resolve(self, spec):
+        if isinstance(spec, FakeSpec):
+            return spec.wrapper_object()
+        return spec
+
+    def alive(self, element):
+        self.delay('alive')
+        return element.exists()
+
+    def visible(self, element):
+        self.delay('properties')
+        return element.exists() and element.visible
+
+    def children(self, element):
+        self.delay('children')
+        return list(element.children)
+
+    def key(self, element):
+        return element.handle
+
+    def properties(self, element):
+        self.delay('properties')
+        return element.handle, element.title, element.control_type, element.auto_id, element.control_id
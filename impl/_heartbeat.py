@@ -0,0 +1,157 @@
+"""
+A shared memory board the crash monitors beat on. Each monitor owns a slot: (sequence, beat time, status,
+errors). The beat time is time.monotonic(), which is system wide (CLOCK_MONOTONIC, GetTickCount64), so the
+main process compares it with its own clock. The main process reads all the slots at once.
+"""
+import mmap
+import os
+import struct
+import tempfile
+from time import monotonic
+
+MAGIC = b'HBB1'
+HEADER = struct.Struct('<4sI')          # magic, number of slots
+SLOT = struct.Struct('<Qdii')           # sequence (odd while being written), beat time, status, errors
+STARTING, OK, ERROR, DONE = 0, 1, 2, 3
+DEFAULT_SLOTS = 64
+BEAT_INTERVAL = 0.5
+TIMEOUT = float(os.environ.get('TRANSAS_UIA_HEARTBEAT_TIMEOUT', 5.0))    # No beat for so long: the monitor hangs
+BOARD_ENV = 'TRANSAS_UIA_BOARD'
+SLOT_ENV = 'TRANSAS_UIA_BOARD_SLOT'
+
+
+class HeartbeatBoard(object):
+    """
+    The main process side. assign() gives a slot to a new monitor, scan() returns the faults: monitors that
+    have reported an error and monitors that have not beaten for `timeout` seconds (hung), each with the
+    time it has happened at, so the detection latency can be measured. A slot that has never beaten is not
+    checked: a monitor that does not write to the board is only watched through its exit.
+
+    >>> board = HeartbeatBoard(slots=4)
+    >>> a, b, c = board.assign(now=100.0), board.assign(now=100.0), board.assign(now=100.0)
+    >>> wa, wb = HeartbeatWriter(board.path, a), HeartbeatWriter(board.path, b)
+    >>> wa.beat(OK, now=101.0); wb.beat(OK, now=101.0)
+    >>> board.scan(2.0, now=102.0)
+    []
+    >>> wb.beat(ERROR, errors=1, now=102.5)
+    >>> board.scan(2.0, now=103.5)
+    [(0, 'hung', 103.0), (1, 'error', 102.5)]
+    >>> wa.beat(DONE, now=103.6)
+    >>> board.scan(2.0, now=110.0)
+    [(1, 'error', 102.5)]
+    >>> wb.seq += 1; wb.beat(OK, now=111.0)         # A writer that died half-way: odd sequence
+    >>> board.read()[1], board._read_slot(1, tries=1)
+    (None, None)
+    >>> wa.close(); wb.close(); board.close()
+    >>> os.path.exists(board.path)
+    False
+    """
+
+    def __init__(self, path=None, slots=DEFAULT_SLOTS):
+        self.owned = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='transas_uia_board_')
+            os.close(fd)
+        self.path = path
+        self.slots = slots
+        size = HEADER.size + slots * SLOT.size
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+            f.truncate(size)
+            self._mm = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(self._mm, 0, MAGIC, slots)
+        self._layout = (0, struct.Struct('<'), struct.Struct('<'))
+
+    @property
+    def used(self):
+        return self._layout[0]
+
+    def assign(self, now=None):
+        used = self.used
+        if used >= self.slots:
+            raise ValueError('The heartbeat board is full (%d slots)' % self.slots)
+        SLOT.pack_into(self._mm, HEADER.size + used * SLOT.size, 0, monotonic() if now is None else now, STARTING, 0)
+        used += 1
+        # Swapped at once, so a concurrent read() sees either the old or the new number of slots
+        self._layout = (used, struct.Struct('<' + 'Qdii' * used), struct.Struct('<' + 'Q16x' * used))
+        return used - 1
+
+    def read(self):
+        """
+        The used slots as a list of (sequence, beat, status, errors), from a single copy of the memory. The
+        sequence numbers are read again after the copy: a slot written meanwhile (odd or changed sequence) is
+        read again on its own, and left out if it keeps changing.
+        """
+        used, records, seqs = self._layout
+        values = records.unpack(self._mm[HEADER.size:HEADER.size + records.size])
+        after = seqs.unpack_from(self._mm, HEADER.size)
+        slots = []
+        for i in range(used):
+            record = values[4 * i:4 * i + 4]
+            if record[0] & 1 or record[0] != after[i]:
+                record = self._read_slot(i)
+            slots.append(record)
+        return slots
+
+    def _read_slot(self, i, tries=3):
+        offset = HEADER.size + i * SLOT.size
+        for _ in range(tries):
+            record = SLOT.unpack_from(self._mm, offset)
+            if not record[0] & 1 and struct.unpack_from('<Q', self._mm, offset)[0] == record[0]:
+                return record
+        return None
+
+    def scan(self, timeout, now=None):
+        slots = self.read()
+        now = monotonic() if now is None else now
+        faults = []
+        for i, record in enumerate(slots):
+            if record is None:
+                continue        # Being written right now
+            seq, beat, status, errors = record
+            if status in (STARTING, DONE):
+                continue        # Not speaking the protocol, or finished
+            if status == ERROR or errors:
+                faults.append((i, 'error', beat))
+            elif now - beat > timeout:
+                faults.append((i, 'hung', beat + timeout))
+        return faults
+
+    def close(self):
+        self._mm.close()
+        if self.owned:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class HeartbeatWriter(object):
+    """
+    The monitor side: beat() writes the slot, the sequence number is odd while the record is incomplete.
+    """
+
+    def __init__(self, path, slot):
+        self.slot = slot
+        self.offset = HEADER.size + slot * SLOT.size
+        with open(path, 'r+b') as f:
+            self._mm = mmap.mmap(f.fileno(), HEADER.size + (slot + 1) * SLOT.size)
+        magic, slots = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or slot >= slots:
+            raise ValueError('Not a heartbeat board or no slot %d: %s' % (slot, path))
+        self.seq = SLOT.unpack_from(self._mm, self.offset)[0] & ~1
+
+    @classmethod
+    def from_env(cls, env=None):
+        env = os.environ if env is None else env
+        if BOARD_ENV not in env:
+            return None
+        return cls(env[BOARD_ENV], int(env.get(SLOT_ENV, 0)))
+
+    def beat(self, status=OK, errors=0, now=None):
+        struct.pack_into('<Q', self._mm, self.offset, self.seq + 1)
+        SLOT.pack_into(self._mm, self.offset, self.seq + 1, monotonic() if now is None else now, status, errors)
+        self.seq += 2
+        struct.pack_into('<Q', self._mm, self.offset, self.seq)
+
+    def close(self):
+        self._mm.close()
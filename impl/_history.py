@@ -0,0 +1,154 @@
+import os
+from math import ceil
+from os.path import expanduser, join
+
+HISTORY_FILE = os.environ.get('TRANSAS_UIA_HISTORY', join(expanduser('~'), '.transas_uia', 'wait_history.json'))
+MAX_SAMPLES = 200
+MIN_SAMPLES = 10
+PERCENTILE = 0.99
+MARGIN = 2.0
+MIN_TIMEOUT = 1.0
+
+CONTEXT = {'suite': [], 'test': [], 'keyword': []}     # Stacks of names, filled in by the listener
+
+
+def enter(kind, name):
+    CONTEXT[kind].append(name)
+
+
+def leave(kind):
+    if CONTEXT[kind]:
+        CONTEXT[kind].pop()
+
+
+def key(locator):
+    """
+    The history key of a wait for `locator` at the current point of the run: the suite and the keyword the
+    waiting keyword was called from (the test itself at the top level).
+
+    >>> enter('suite', 'Calc'); enter('test', 'Adds'); enter('keyword', 'Add Numbers')
+    >>> enter('keyword', 'Wait Until All')
+    >>> key('result')
+    'Calc\\tAdd Numbers\\tresult'
+    >>> leave('keyword'); leave('keyword'); enter('keyword', 'Wait Until All')
+    >>> key('result')
+    'Calc\\tAdds\\tresult'
+    >>> leave('keyword'); leave('test'); leave('suite')
+    """
+    kws = CONTEXT['keyword']
+    caller = kws[-2] if len(kws) > 1 else (CONTEXT['test'] or [''])[-1]
+    return '%s\t%s\t%s' % ((CONTEXT['suite'] or [''])[-1], caller, locator)
+
+
+def percentile(samples, q):
+    """
+    The nearest-rank percentile.
+
+    >>> percentile([5, 1, 4, 2, 3], 0.5), percentile(range(1, 101), 0.99), percentile([7], 0.99)
+    (3, 99, 7)
+    """
+    s = sorted(samples)
+    return s[min(len(s), max(1, int(ceil(q * len(s))))) - 1]
+
+
+class WaitHistory(object):
+    """
+    Seconds the waits took to be satisfied, the latest `max_samples` per key, stored in a JSON file. With
+    `adaptive` on, timeout() gives p`q` of the samples times `margin` instead of the written timeout, but
+    never more than the written one and never less than `min_timeout`; keys with fewer than `min_samples`
+    samples keep the written timeout, and so does a wait written as forever.
+
+    >>> import tempfile
+    >>> path = join(tempfile.mkdtemp(), 'history.json')
+    >>> h = WaitHistory(path)
+    >>> for i in range(20):
+    ...     h.record('k', 0.5 + i * 0.1)
+    >>> h.timeout('k', 30.0)
+    30.0
+    >>> h.adaptive = True
+    >>> h.timeout('k', 30.0), h.timeout('k', 3.0), h.timeout('other', 30.0), h.timeout('k', None)
+    (4.8, 3.0, 30.0, None)
+    >>> h.save()
+    >>> h2 = WaitHistory(path)
+    >>> h2.record('k', 10.0)
+    >>> h2.save()
+    >>> len(WaitHistory(path).samples('k')), WaitHistory(path).samples('k')[-1]
+    (21, 10.0)
+    """
+
+    def __init__(self, path=None, adaptive=False, q=PERCENTILE, margin=MARGIN, min_samples=MIN_SAMPLES,
+                 min_timeout=MIN_TIMEOUT, max_samples=MAX_SAMPLES):
+        self.path = path
+        self.adaptive = adaptive
+        self.q = q
+        self.margin = margin
+        self.min_samples = min_samples
+        self.min_timeout = min_timeout
+        self.max_samples = max_samples
+        self._waits = self._load()
+        self._new = {}
+
+    def _load(self):
+        if not self.path:
+            return {}
+        from impl._calibration import load_cache
+        waits = load_cache(self.path).get('waits')
+        return waits if isinstance(waits, dict) else {}
+
+    def samples(self, key):
+        return self._waits.get(key, [])
+
+    def record(self, key, seconds):
+        s = self._waits.setdefault(key, [])
+        s.append(round(seconds, 4))
+        del s[:-self.max_samples]
+        self._new.setdefault(key, []).append(round(seconds, 4))
+
+    def timeout(self, key, written):
+        """
+        The timeout in seconds for a wait written with `written` seconds (None = forever).
+        """
+        if not self.adaptive or written is None:
+            return written
+        s = self._waits.get(key)
+        if not s or len(s) < self.min_samples:
+            return written
+        learned = max(self.min_timeout, round(percentile(s, self.q) * self.margin, 4))
+        return min(written, learned)
+
+    def save(self):
+        """
+        Merges the samples recorded since the last save into the file, so parallel runs do not lose each
+        other's samples.
+        """
+        if not self.path or not self._new:
+            return
+        from impl._calibration import update_cache
+
+        def merge(cache):
+            waits = cache.get('waits')
+            if not isinstance(waits, dict):
+                waits = cache['waits'] = {}
+            for k, new in self._new.items():
+                s = waits.setdefault(k, [])
+                s.extend(new)
+                del s[:-self.max_samples]
+        cache = update_cache(self.path, merge)
+        if cache is not None:
+            self._waits = cache['waits']
+            self._new = {}
+
+
+HISTORY = None
+
+
+def get_history():
+    global HISTORY
+    if HISTORY is None:
+        HISTORY = WaitHistory(HISTORY_FILE, adaptive=os.environ.get('TRANSAS_UIA_ADAPTIVE_TIMEOUTS', '') == '1')
+    return HISTORY
+
+
+def set_history(history):
+    global HISTORY
+    HISTORY = history
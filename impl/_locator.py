@@ -0,0 +1,147 @@
+import re
+from collections import OrderedDict
+
+from impl._params import IronbotParametersException
+
+SELECTIVITY = ('auto_id', 'control_id', 'title', 'title_re', 'control_type')    # The most selective first
+FIELDS = {'auto_id': 'auto_id', 'control_id': 'control_id', 'title': 'title', 'title_re': 'title',
+          'control_type': 'control_type'}
+
+
+def _equals(v):
+    return lambda x: x == v
+
+
+def _equals_str(v):
+    v = str(v)
+    return lambda x: x is not None and str(x) == v
+
+
+def _matches(pattern):
+    m = pattern.match
+    return lambda x: m(x or '') is not None
+
+
+class Locator(object):
+    """
+    Criteria compiled once into a matcher: the checks run in the order of SELECTIVITY and stop at the first
+    failing one, so an element property is only read when the more selective criteria have matched.
+    `get(element, field)` reads a property ('title', 'control_type', 'auto_id' or 'control_id').
+
+    >>> from impl._fake_backend import FakeControl
+    >>> loc = Locator({'title_re': '[0-3]$', 'control_type': 'Button'})
+    >>> loc.matches(FakeControl('2', 'Button')), loc.matches(FakeControl('2', 'Text')), loc.order
+    (True, False, ('title_re', 'control_type'))
+    >>> Locator({'control_id': 121}).matches(FakeControl(control_id='121'))
+    True
+    >>> reads = []
+    >>> def get(el, field):
+    ...     reads.append(field)
+    ...     return el[field]
+    >>> Locator({'control_type': 'Button', 'auto_id': 'ok'}).matches({'auto_id': 'no'}, get), reads
+    (False, ['auto_id'])
+    >>> try: Locator({'name': 'OK'})
+    ... except IronbotParametersException as e: print(e)
+    Unknown locator criteria: name (expected auto_id, control_id, title, title_re, control_type)
+    >>> try: Locator({'title_re': '('})
+    ... except IronbotParametersException as e: print(e)
+    Bad title_re '(': missing ), unterminated subpattern at position 0
+    """
+    __slots__ = ('key', 'criteria', 'order', '_checks')
+
+    def __init__(self, criteria, compile_re=re.compile):
+        unknown = set(criteria) - set(SELECTIVITY)
+        if unknown:
+            raise IronbotParametersException('Unknown locator criteria: %s (expected %s)' % (
+                ', '.join(sorted(unknown)), ', '.join(SELECTIVITY)))
+        self.criteria = dict((k, v) for k, v in criteria.items() if v is not None)
+        self.key = tuple(sorted(self.criteria.items()))
+        self.order = tuple(name for name in SELECTIVITY if name in self.criteria)
+        checks = []
+        for name in self.order:
+            v = self.criteria[name]
+            if name == 'title_re':
+                try:
+                    test = _matches(compile_re(v))
+                except re.error as e:
+                    raise IronbotParametersException('Bad title_re %r: %s' % (v, e))
+            elif name == 'control_id':
+                test = _equals_str(v)
+            else:
+                test = _equals(v)
+            checks.append((FIELDS[name], test))
+        self._checks = tuple(checks)
+
+    def matches(self, element, get=getattr):
+        for field, test in self._checks:
+            if not test(get(element, field)):
+                return False
+        return True
+
+    def filter(self, elements, get=getattr):
+        return [el for el in elements if self.matches(el, get)]
+
+    def __repr__(self):
+        return 'Locator(%r)' % dict(self.key)
+
+
+class LocatorCache(object):
+    """
+    Compiled locators and title_re patterns, the least recently used evicted first.
+
+    >>> c = LocatorCache(size=2)
+    >>> c.locator({'title': 'OK'}) is c.locator({'title': 'OK'})
+    True
+    >>> _ = c.locator({'auto_id': 'a'}), c.locator({'auto_id': 'b'})
+    >>> c.pattern('[0-9]+') is c.pattern('[0-9]+')
+    True
+    >>> c.stats()
+    {'hits': 2, 'misses': 4, 'evictions': 1, 'size': 2, 'patterns': 1}
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._items = OrderedDict()
+        self._patterns = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, items, key, make):
+        v = items.get(key)
+        if v is not None:
+            items.move_to_end(key)
+            self.hits += 1
+            return v
+        self.misses += 1
+        v = items[key] = make()
+        if len(items) > self.size:
+            items.popitem(last=False)
+            self.evictions += 1
+        return v
+
+    def pattern(self, p):
+        return self._get(self._patterns, p, lambda: re.compile(p))
+
+    def locator(self, criteria):
+        key = tuple(sorted((k, v) for k, v in criteria.items() if v is not None))
+        return self._get(self._items, key, lambda: Locator(criteria, self.pattern))
+
+    def clear(self):
+        self._items.clear()
+        self._patterns.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._items),
+                'patterns': len(self._patterns)}
+
+
+LOCATORS = LocatorCache()
+
+
+def compile_locator(criteria):
+    return LOCATORS.locator(criteria)
+
+
+def compile_pattern(p):
+    return LOCATORS.pattern(p)
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LookupCache(object):
+    """
+    Resolved elements keyed by (window handle, criteria), least recently used evicted first. A cached element
+    is checked with `alive` before it is returned, a stale one is re-resolved.
+
+    >>> c = LookupCache(size=2)
+    >>> calls = []
+    >>> def resolve(v):
+    ...     calls.append(v)
+    ...     return [v]
+    >>> alive = lambda el: el[0] is not None
+    >>> c.get(c.key(1, {'title': 'a'}), lambda: resolve('a'), alive)
+    ['a']
+    >>> c.get(c.key(1, {'title': 'a'}), lambda: resolve('a'), alive), calls
+    (['a'], ['a'])
+    >>> el = c.get(c.key(1, {'title': 'b'}), lambda: resolve('b'), alive)
+    >>> el[0] = None
+    >>> c.get(c.key(1, {'title': 'b'}), lambda: resolve('b'), alive), calls
+    (['b'], ['a', 'b', 'b'])
+    >>> _ = c.get(c.key(2, {'title': 'c'}), lambda: resolve('c'), alive)
+    >>> c.key(1, {'title': 'a'}) in c, len(c)
+    (False, 2)
+    >>> c.stats()
+    {'hits': 1, 'misses': 4, 'stale': 1, 'evictions': 1, 'size': 2}
+    >>> c.invalidate(2)
+    1
+    >>> c.invalidate()
+    1
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(handle, criteria):
+        return handle, tuple(sorted(criteria.items()))
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, resolve, alive):
+        el = self._items.get(key, _MISSING)
+        if el is not _MISSING:
+            if alive(el):
+                self._items.move_to_end(key)
+                self.hits += 1
+                return el
+            del self._items[key]
+            self.stale += 1
+        self.misses += 1
+        el = resolve()
+        self._items[key] = el
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+        return el
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def invalidate(self, handle=None):
+        """
+        Drops the elements found in the window with the given handle, or all of them. Returns how many.
+        """
+        if handle is None:
+            n = len(self._items)
+            self._items.clear()
+            return n
+        keys = [k for k in self._items if k[0] == handle]
+        for k in keys:
+            del self._items[k]
+        return len(keys)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stale': self.stale, 'evictions': self.evictions,
+                'size': len(self._items)}
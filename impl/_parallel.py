@@ -0,0 +1,36 @@
+MAX_WORKERS = 8
+
+
+def parallel_map(f, items, max_workers=None):
+    """
+    Calls f for every item on a bounded thread pool. Returns a list of (result, exception) pairs in the
+    order of the items; exactly one of the two is None unless f returned None.
+
+    >>> def inv(x): return 1 // x
+    >>> parallel_map(inv, [1, 0, -1])[0], parallel_map(inv, [1, 0, -1])[2]
+    ((1, None), (-1, None))
+    >>> res, exc = parallel_map(inv, [1, 0, -1])[1]
+    >>> res, type(exc).__name__
+    (None, 'ZeroDivisionError')
+    >>> parallel_map(inv, [])
+    []
+    >>> from time import sleep, monotonic
+    >>> t0 = monotonic()
+    >>> _ = parallel_map(sleep, [0.1] * 4, max_workers=4)
+    >>> monotonic() - t0 < 0.3
+    True
+    """
+    items = list(items)
+
+    def call(item):
+        try:
+            return f(item), None
+        except Exception as e:
+            return None, e
+
+    if len(items) <= 1:
+        return [call(i) for i in items]
+    from concurrent.futures import ThreadPoolExecutor
+    workers = min(max_workers or MAX_WORKERS, len(items))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(call, items))
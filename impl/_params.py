@@ -1,5 +1,4 @@
 import logging
-import re
 
 #from _util import assert_raises, IronbotException, Delay
 #from _attr import AttributeDict
@@ -25,8 +24,11 @@ def parse_re(p):
     True
     >>> bool(parse_re('1').match('0'))
     False
+    >>> parse_re('1') is parse_re('1')
+    True
     """
-    return re.compile(parse(p))
+    from impl._locator import compile_pattern
+    return compile_pattern(parse(p))
 
 
 BOOL_VALS = {"TRUE": True, "FALSE": False, 'Y': True, 'N': False, 'YES': True, 'NO': False}
@@ -61,9 +63,16 @@ def parse_bool(param):
 
 
 def pop_menu_path(params):
+    """
+    >>> p = ['File', 'Open', '<END>', 'x']
+    >>> pop_menu_path(p), p
+    (['File', 'Open'], ['x'])
+    >>> pop_menu_path(['Edit', 'Undo'])
+    ['Edit', 'Undo']
+    """
     res = []
     while params:
-        v = parse(params)
+        v = parse(params.pop(0))
         if v == '<END>':
             break
         res.append(v)
@@ -133,16 +142,70 @@ def parse_named2(pdict, kw):
     return res
 
 
-def robot_args(pdescr):
+def compile_args(pdescr, f):
+    """
+    Compiles a (positional rules, named rules) descriptor into a specialized caller of `f`, once.
+    'parse' rules (identity) cost nothing on a call, named parameters are checked with one set operation,
+    and only the renamed or converted ones are touched.
+
+    >>> def show(*a, **kw): return a, sorted(kw.items())
+    >>> c = compile_args(((parse, parse_bool), {'a': ('a', parse), 'b': ('b1', parse_bool)}), show)
+    >>> c('x', 'yes', 'extra', a=1, b='no')
+    (('x', True), [('a', 1), ('b1', False)])
+    >>> c('x', 'n')
+    (('x', False), [])
+    >>> compile_args(((parse, parse), {}), show)(1, 2, 3)
+    ((1, 2), [])
+    >>> try: c('x')
+    ... except IronbotParametersException as e: print(e)
+    Expected 2 positional parameter(s), got 1
+    >>> try: c('x', 'y', c=1, d=2)
+    ... except IronbotParametersException as e: print(e)
+    Unknown named parameter(s): c, d
+    """
     pos, d = pdescr
-    def decorator(f):
+    n = len(pos)
+    convert = tuple((i, r) for i, r in enumerate(pos) if r is not parse)
+    known = frozenset(d)
+    special = tuple((name, rname, None if rproc is parse else rproc)
+                    for name, (rname, rproc) in d.items() if rname != name or rproc is not parse)
+
+    def named(kw):
+        if not known.issuperset(kw):
+            raise IronbotParametersException("Unknown named parameter(s): %s" % ', '.join(sorted(set(kw) - known)))
+        for name, rname, rproc in special:
+            if name in kw:
+                v = kw.pop(name)
+                kw[rname] = v if rproc is None else rproc(v)
+
+    def trimmed(a):
+        if len(a) < n:
+            raise IronbotParametersException("Expected %d positional parameter(s), got %d" % (n, len(a)))
+        return a[:n]
+
+    if convert:
         def callable(*a, **kw):
-            params = list(a)
-            fixed = parse_positional(pos, params)
-            named = parse_named2(d, kw)
-            return f(*fixed, **named)
+            if kw:
+                named(kw)
+            a = list(trimmed(a) if len(a) != n else a)
+            for i, r in convert:
+                a[i] = r(a[i])
+            return f(*a, **kw)
+    else:
+        def callable(*a, **kw):
+            if kw:
+                named(kw)
+            if len(a) != n:
+                a = trimmed(a)
+            return f(*a, **kw)
+    return callable
+
+
+def robot_args(pdescr):
+    def decorator(f):
+        callable = compile_args(pdescr, f)
         callable.__doc__ = f.__doc__
+        callable.__name__ = f.__name__
+        callable.__module__ = f.__module__
         return callable
     return decorator
-
-
@@ -0,0 +1,179 @@
+import fnmatch
+import os
+import re
+import sys
+from os.path import basename, join
+from threading import Event, Thread, get_ident
+
+DEFAULT_RATE = 200.0       # Samples per second
+SLEEP_MARK = '[sleeping]'
+SLEEPING = frozenset([      # (file, function) of the Python frames that block the thread
+    ('threading.py', 'wait'), ('threading.py', 'wait_for'), ('threading.py', '_wait_for_tstate_lock'),
+    ('_clock.py', 'sleep'), ('_clock.py', 'wait'), ('_clock.py', 'wait_for'),
+    ('subprocess.py', 'wait'), ('subprocess.py', '_wait'), ('selectors.py', 'select'),
+    ('socket.py', 'readinto'), ('queue.py', 'get'),
+])
+
+
+class Sampler(object):
+    """
+    Samples the stack of one thread `rate` times a second from a background thread, counting the collapsed
+    stacks ('outer;...;inner' frames as file:function). A sample whose innermost frame blocks (see SLEEPING)
+    gets an extra SLEEP_MARK frame, so waiting shows up apart from the real work in a flame graph.
+
+    >>> import time
+    >>> done = Event()
+    >>> def busy():
+    ...     t = time.monotonic() + 0.15
+    ...     while time.monotonic() < t:
+    ...         pass
+    >>> def work():
+    ...     busy()
+    ...     done.wait(0.15)
+    >>> s = Sampler(rate=500)
+    >>> s.start()
+    >>> work()
+    >>> s.stop()
+    >>> busy_n = sum(n for st, n in s.counts.items() if st.endswith(':busy'))
+    >>> sleep_n = sum(n for st, n in s.counts.items() if 'Event.wait;' in st and st.endswith(SLEEP_MARK))
+    >>> busy_n > 10, sleep_n > 10, s.sleeping == sleep_n
+    (True, True, True)
+    >>> line = s.collapsed().splitlines()[0]
+    >>> line.rsplit(' ', 1)[1].isdigit(), ';' in line
+    (True, True)
+    """
+
+    def __init__(self, thread_id=None, rate=DEFAULT_RATE):
+        self.thread_id = thread_id or get_ident()
+        self.interval = 1.0 / rate
+        self.counts = {}
+        self.samples = 0
+        self.sleeping = 0
+        self._labels = {}
+        self._stop = Event()
+        self._thread = None
+
+    def _label(self, code):
+        """
+        ('file:function', whether the frame blocks), cached per code object.
+        """
+        label = self._labels.get(code)
+        if label is None:
+            f = basename(code.co_filename)
+            label = self._labels[code] = ('%s:%s' % (f, getattr(code, 'co_qualname', code.co_name)),
+                                          (f, code.co_name) in SLEEPING)
+        return label
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        if not labels:
+            return
+        stack = ';'.join(l for l, _ in reversed(labels))
+        if labels[0][1]:
+            stack += ';' + SLEEP_MARK
+            self.sleeping += 1
+        self.samples += 1
+        self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread = Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self):
+        """
+        The samples in the collapsed-stack format of flamegraph.pl / speedscope / inferno: a line per
+        distinct stack with its count, the most frequent first.
+        """
+        return ''.join('%s %d\n' % (stack, n) for stack, n in sorted(self.counts.items(), key=lambda kv: -kv[1]))
+
+
+class Profiler(object):
+    """
+    Profiles the selected tests: those matching one of the `tests` name patterns (glob, case-insensitive,
+    against the name or the long name) or having one of the `tags`. Each one gets <directory>/<long name>.folded.
+
+    >>> p = Profiler('out', tests=['*login*'], tags=['slow'])
+    >>> p.selected('Login Works', {}), p.selected('Calc', {'tags': ['Slow']}), p.selected('Calc', {'tags': []})
+    (True, True, False)
+    >>> Profiler('out').selected('Anything', {})
+    True
+    >>> p.path('Suite.Sub.Test: 1/2')
+    'out/Suite.Sub.Test_1_2.folded'
+    """
+
+    def __init__(self, directory, tests=(), tags=(), rate=DEFAULT_RATE):
+        self.directory = directory
+        self.tests = [t.lower() for t in tests]
+        self.tags = set(t.lower() for t in tags)
+        self.rate = rate
+        self.sampler = None
+        self._name = None
+
+    def selected(self, name, attrs):
+        if not self.tests and not self.tags:
+            return True
+        names = (name.lower(), attrs.get('longname', name).lower())
+        if any(fnmatch.fnmatchcase(n, p) for p in self.tests for n in names):
+            return True
+        return bool(self.tags.intersection(t.lower() for t in attrs.get('tags', ())))
+
+    def path(self, longname):
+        return join(self.directory, re.sub(r'[^\w.-]+', '_', longname) + '.folded')
+
+    def start_test(self, name, attrs):
+        if self.selected(name, attrs):
+            self._name = attrs.get('longname', name)
+            self.sampler = Sampler(rate=self.rate)
+            self.sampler.start()
+
+    def end_test(self):
+        """
+        Stops the sampling and writes the file. Returns its path (None if the test was not profiled).
+        """
+        s, self.sampler = self.sampler, None
+        if s is None:
+            return None
+        s.stop()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self.path(self._name)
+        with open(path, 'w') as f:
+            f.write(s.collapsed())
+        return path
+
+
+PROFILER = None
+
+
+def _split(v):
+    return [p.strip() for p in (v or '').split(',') if p.strip()]
+
+
+def start_from_env():
+    """
+    Profiling is on when $TRANSAS_UIA_PROFILE names the output directory; $TRANSAS_UIA_PROFILE_TESTS and
+    $TRANSAS_UIA_PROFILE_TAGS (comma separated) select the tests, all of them by default;
+    $TRANSAS_UIA_PROFILE_RATE is the sampling rate in Hz.
+    """
+    global PROFILER
+    directory = os.environ.get('TRANSAS_UIA_PROFILE')
+    if directory and PROFILER is None:
+        PROFILER = Profiler(directory, _split(os.environ.get('TRANSAS_UIA_PROFILE_TESTS')),
+                                _split(os.environ.get('TRANSAS_UIA_PROFILE_TAGS')),
+                                float(os.environ.get('TRANSAS_UIA_PROFILE_RATE', DEFAULT_RATE)))
+    return PROFILER
@@ -0,0 +1,282 @@
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from itertools import count
+from time import monotonic, strftime
+
+from impl import _clock
+from impl._backend import Backend, BackendException
+
+RECORDED = ('start', 'connect', 'window', 'find', 'find_all', 'enabled', 'click', 'type_text', 'select_menu', 'handle',
+            'resolve', 'alive', 'visible', 'children', 'key', 'properties')
+HASHABLE = ('handle', 'key')
+PLAIN = (type(None), bool, int, float, str)
+RECORDING_FILE = os.environ.get('TRANSAS_UIA_RECORDING', 'recording.jsonl')
+_SESSIONS = count(1)
+
+
+class ReplayError(BackendException):
+    """
+    An error the recorded call has raised: `type` is the name of the original exception.
+    """
+
+    def __init__(self, type, message):
+        BackendException.__init__(self, message)
+        self.type = type
+
+
+def _hashable(v):
+    if isinstance(v, list):
+        return tuple(_hashable(x) for x in v)
+    return v
+
+
+class RecordingBackend(Backend):
+    """
+    Passes every call to the `inner` backend and appends it to a file: a JSON line
+    [op, args, result, seconds, error, session] per call. Apps, windows and elements are written as
+    {"o": <number>} (with their type and repr), the same number every time the same object is passed or
+    returned. The numbers start again with every recording backend, so each one writes its lines under its
+    own `session`: runs appended to the same file (or recorded into it at once) do not mix.
+    """
+
+    def __init__(self, inner, path=None):
+        self.inner = inner
+        self.path = path or RECORDING_FILE
+        self.session = '%s-%d-%d' % (strftime('%Y%m%dT%H%M%S'), os.getpid(), next(_SESSIONS))
+        self._ids = {}
+        self._objects = []      # Keeps the recorded objects alive, so their id() stays unique
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a')
+
+    def _encode(self, v):
+        if isinstance(v, PLAIN):
+            return v
+        if isinstance(v, (list, tuple)):
+            return [self._encode(x) for x in v]
+        if isinstance(v, dict):
+            return dict((k, self._encode(x)) for k, x in sorted(v.items()))
+        n = self._ids.get(id(v))
+        if n is None:
+            n = self._ids[id(v)] = len(self._ids) + 1
+            self._objects.append(v)
+            return {'o': n, 't': type(v).__name__, 'r': repr(v)[:80]}
+        return {'o': n}
+
+    def _call(self, op, args, kwargs):
+        t0 = monotonic()
+        error = res = None
+        try:
+            res = getattr(self.inner, op)(*args, **kwargs)
+            return res
+        except Exception as e:
+            error = [type(e).__name__, str(e)]
+            raise
+        finally:
+            seconds = monotonic() - t0
+            with self._lock:
+                line = json.dumps([op, self._encode([list(args), kwargs]), self._encode(res),
+                                   round(seconds, 6), error, self.session], separators=(',', ':'), default=repr)
+                self._file.write(line + '\n')
+                self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _recorder(op):
+    def method(self, *args, **kwargs):
+        return self._call(op, args, kwargs)
+    method.__name__ = op
+    return method
+
+
+for _op in RECORDED:
+    setattr(RecordingBackend, _op, _recorder(_op))
+
+
+class ReplayObject(object):
+    """
+    Stands for a recorded app, window or element. Apps are also handled by the teardown directly, so it
+    acts like an app that exits when asked to.
+    """
+    __slots__ = ('id', 'type', 'label', 'running')
+    process = None
+
+    def __init__(self, id, type=None, label=None):
+        self.id = id
+        self.type = type
+        self.label = label
+        self.running = True
+
+    def is_process_running(self):
+        return self.running
+
+    def windows(self):
+        return [self]
+
+    def close(self):
+        self.running = False
+
+    def kill(self, soft=False):
+        self.running = False
+
+    def __repr__(self):
+        return '<replayed %s>' % (self.label or '%s %d' % (self.type, self.id))
+
+
+class ReplayBackend(Backend):
+    """
+    Answers the calls from one session of a recording (the last one recorded by default), without any
+    application: a call gets the responses recorded for the same operation and arguments, in their order, the
+    last one repeated once they are used up. With `timing`, every call takes as long as it took when recorded.
+
+    >>> import tempfile
+    >>> from impl._fake_backend import FakeBackend
+    >>> path = os.path.join(tempfile.mkdtemp(), 'calc.jsonl')
+    >>> rec = RecordingBackend(FakeBackend(), path)
+    >>> app = rec.start('calc.exe')
+    >>> w = rec.resolve(rec.window(app, 'Calculator'))
+    >>> b = rec.resolve(rec.find(w, title='7', control_type='Button'))
+    >>> rec.click(b), rec.properties(b)[1:]
+    (None, ('7', 'Button', 'num7Button', 137))
+    >>> try: rec.find_all(w, title_re='(')
+    ... except Exception as e: print(type(e).__name__)
+    IronbotParametersException
+    >>> rec.close()
+    >>> rb = ReplayBackend(path)
+    >>> app = rb.start('calc.exe')
+    >>> w = rb.resolve(rb.window(app, 'Calculator'))
+    >>> b = rb.resolve(rb.find(w, title='7', control_type='Button'))
+    >>> w, rb.click(b), rb.properties(b)[1:]
+    (<replayed FakeControl('Calculator', 'Window')>, None, ('7', 'Button', 'num7Button', 137))
+    >>> try: rb.find_all(w, title_re='(')
+    ... except ReplayError as e: print(e.type)
+    IronbotParametersException
+    >>> try: rb.find(w, title='8', control_type='Button')
+    ... except BackendException as e: print(str(e).split('(')[0])
+    No recorded response for find
+    >>> app.is_process_running(), [x.close() for x in app.windows()], app.is_process_running()
+    (True, [None], False)
+
+    A second run appended to the file numbers its objects from 1 again, in a session of its own:
+
+    >>> rec = RecordingBackend(FakeBackend(), path)
+    >>> w = rec.resolve(rec.window(rec.start('calc.exe'), 'Calculator'))
+    >>> rec.properties(rec.resolve(rec.find(w, title='8', control_type='Button')))[1]
+    '8'
+    >>> rec.close()
+    >>> rb = ReplayBackend(path)
+    >>> len(rb.sessions), rb.session == rb.sessions[-1] == rec.session
+    (2, True)
+    >>> w = rb.resolve(rb.window(rb.start('calc.exe'), 'Calculator'))
+    >>> rb.properties(rb.resolve(rb.find(w, title='8', control_type='Button')))[1]
+    '8'
+    >>> try: rb.find(w, title='7', control_type='Button')
+    ... except BackendException as e: print(str(e).split('(')[0])
+    No recorded response for find
+    >>> rb = ReplayBackend(path, session=rb.sessions[0])
+    >>> w = rb.resolve(rb.window(rb.start('calc.exe'), 'Calculator'))
+    >>> rb.properties(rb.resolve(rb.find(w, title='7', control_type='Button')))[1]
+    '7'
+    """
+
+    def __init__(self, path=None, timing=False, session=None):
+        self.path = path or RECORDING_FILE
+        self.timing = timing
+        self.objects = {}
+        self.calls = 0
+        self._responses = {}
+        self._lock = threading.Lock()
+        sessions = OrderedDict()        # session -> its lines, in the order the sessions were started
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    sessions.setdefault(record[5] if len(record) > 5 else None, []).append(record[:5])
+        self.sessions = list(sessions)
+        if session is None and self.sessions:
+            session = self.sessions[-1]
+        if session is not None and session not in sessions:
+            raise BackendException("No session '%s' in the recording %s" % (session, self.path))
+        self.session = session
+        for op, args, res, seconds, error in sessions.get(session, ()):
+            self._index(args)
+            self._index(res)
+            key = self._key(op, args)
+            self._responses.setdefault(key, deque()).append((res, seconds, error))
+
+    def _index(self, v):
+        """
+        Creates the stand-ins of the objects, from their first (labelled) occurrence.
+        """
+        if isinstance(v, list):
+            for x in v:
+                self._index(x)
+        elif isinstance(v, dict):
+            if 'o' in v and len(v) <= 3 and isinstance(v['o'], int):
+                if v['o'] not in self.objects:
+                    self.objects[v['o']] = ReplayObject(v['o'], v.get('t'), v.get('r'))
+            else:
+                for x in v.values():
+                    self._index(x)
+
+    @staticmethod
+    def _key(op, args):
+        return op, json.dumps(ReplayBackend._strip(args), separators=(',', ':'), sort_keys=True)
+
+    @staticmethod
+    def _strip(v):
+        if isinstance(v, list):
+            return [ReplayBackend._strip(x) for x in v]
+        if isinstance(v, dict):
+            if 'o' in v and len(v) <= 3 and isinstance(v['o'], int):
+                return {'o': v['o']}
+            return dict((k, ReplayBackend._strip(x)) for k, x in v.items())
+        return v
+
+    def _encode(self, v):
+        if isinstance(v, ReplayObject):
+            return {'o': v.id}
+        if isinstance(v, PLAIN):
+            return v
+        if isinstance(v, (list, tuple)):
+            return [self._encode(x) for x in v]
+        if isinstance(v, dict):
+            return dict((k, self._encode(x)) for k, x in v.items())
+        raise BackendException('Cannot replay a call with %r, it was not returned by the recording' % (v,))
+
+    def _decode(self, v):
+        if isinstance(v, list):
+            return [self._decode(x) for x in v]
+        if isinstance(v, dict):
+            if 'o' in v and len(v) <= 3 and isinstance(v['o'], int):
+                return self.objects[v['o']]
+            return dict((k, self._decode(x)) for k, x in v.items())
+        return v
+
+    def _call(self, op, args, kwargs):
+        key = self._key(op, self._encode([list(args), kwargs]))
+        with self._lock:
+            self.calls += 1
+            queue = self._responses.get(key)
+            if not queue:
+                raise BackendException('No recorded response for %s(%s)' % key)
+            res, seconds, error = queue.popleft() if len(queue) > 1 else queue[0]
+        if self.timing and seconds:
+            _clock.CLOCK.sleep(seconds)
+        if error:
+            raise ReplayError(*error)
+        res = self._decode(res)
+        if op in HASHABLE:
+            return _hashable(res)
+        if op == 'properties':
+            return (_hashable(res[0]),) + tuple(res[1:])
+        return res
+
+
+for _op in RECORDED:
+    setattr(ReplayBackend, _op, _recorder(_op))
+
+del _op
@@ -0,0 +1,229 @@
+"""
+Runs Robot suites sharded over parallel worker processes.
+
+    python -m impl._shard [--workers N] [--outputdir results] [--durations file.json] <suite paths> [-- robot options]
+
+Every worker is a separate robot process, so it has its own app registry, monitoring, calibration and
+listener state. The suites are spread over the workers by their durations in the previous runs, longest
+first; the outputs are merged with rebot and the durations are updated. A suite is a .robot file with test
+cases or tasks, or a whole directory when it has an initialization file (__init__.robot): its settings
+(Suite Setup, Force Tags...) apply to all of its children, so they are not run apart.
+"""
+import heapq
+import logging
+import os
+import re
+import subprocess
+import sys
+from os.path import abspath, expanduser, isdir, join
+
+DURATIONS_FILE = os.environ.get('TRANSAS_UIA_DURATIONS', join(expanduser('~'), '.transas_uia', 'suite_durations.json'))
+DEFAULT_DURATION = 60.0
+WORKER_ENV = 'TRANSAS_UIA_SHARD'
+TESTS_SECTION = re.compile(r'^\*+[ \t]*(test[ \t]*cases?|tasks?)[ \t]*(\*|$)', re.I | re.M)
+
+
+def _has_tests(path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return TESTS_SECTION.search(f.read()) is not None
+
+
+def _is_init(name):
+    return os.path.splitext(name)[0] == '__init__'
+
+
+def find_suites(paths):
+    """
+    The suites of the paths (files or directories, searched recursively), sorted: the .robot files with a
+    test cases or tasks section, and the directories with an initialization file that contain such files.
+    Initialization and resource files are not suites. A directory given with an initialization file is a
+    single suite: give its subdirectories instead to shard it, without its settings.
+
+    >>> import tempfile
+    >>> top = tempfile.mkdtemp()
+    >>> for name, text in [('a.robot', '*** Test Cases ***'), ('common.robot', '*** Keywords ***'),
+    ...                    ('sub/__init__.robot', '*** Settings ***'), ('sub/b.robot', '*** Tasks ***'),
+    ...                    ('sub/c.robot', '*** Test Cases ***'), ('more/d.robot', '***Test Case***'),
+    ...                    ('empty/__init__.robot', '*** Settings ***')]:
+    ...     os.makedirs(os.path.dirname(join(top, name)), exist_ok=True)
+    ...     with open(join(top, name), 'w') as f:
+    ...         _ = f.write(text)
+    >>> [os.path.relpath(s, top) for s in find_suites([top])]
+    ['a.robot', 'more/d.robot', 'sub']
+    >>> [os.path.relpath(s, top) for s in find_suites([join(top, 'sub', 'c.robot')])]
+    ['sub/c.robot']
+    >>> find_suites([join(top, 'sub')]) == [join(top, 'sub')], find_suites([join(top, 'empty')])
+    (True, [])
+    """
+    res = []
+    for p in paths:
+        if not isdir(p):
+            res.append(abspath(p))
+            continue
+        for d, dirs, files in os.walk(p):
+            dirs.sort()
+            if any(_is_init(f) for f in files):
+                # Its initialization file applies to everything under it: one suite
+                if any(f.endswith('.robot') and not _is_init(f) and _has_tests(join(dd, f))
+                       for dd, _, ff in os.walk(d) for f in ff):
+                    res.append(abspath(d))
+                dirs[:] = []
+                continue
+            res.extend(abspath(join(d, f)) for f in files
+                       if f.endswith('.robot') and not _is_init(f) and _has_tests(join(d, f)))
+    return sorted(set(res))
+
+
+def estimate(suites, durations):
+    """
+    The expected seconds of every suite: its last duration, or the median of the known ones for a new suite.
+
+    >>> estimate(['a', 'b', 'c'], {'a': 10.0, 'c': 30.0, 'x': 20.0})
+    {'a': 10.0, 'b': 20.0, 'c': 30.0}
+    >>> estimate(['a'], {})
+    {'a': 60.0}
+    """
+    known = sorted(durations.values())
+    default = known[len(known) // 2] if known else DEFAULT_DURATION
+    return dict((s, float(durations.get(s, default))) for s in suites)
+
+
+def balance(costs, workers):
+    """
+    Splits the suites into at most `workers` shards of similar total cost: the longest suite goes to the
+    least loaded shard first. Returns lists of suites, the most loaded shard first.
+
+    >>> balance({'a': 8, 'b': 7, 'c': 6, 'd': 5, 'e': 4}, 2)
+    [['a', 'd', 'e'], ['b', 'c']]
+    >>> balance({'a': 1}, 4)
+    [['a']]
+    """
+    shards = [(0.0, i, []) for i in range(min(workers, len(costs)))]
+    for suite in sorted(costs, key=lambda s: (-costs[s], s)):
+        load, i, suites = heapq.heappop(shards)
+        suites.append(suite)
+        heapq.heappush(shards, (load + costs[suite], i, suites))
+    return [suites for _, _, suites in sorted(shards, key=lambda s: (-s[0], s[1]))]
+
+
+def _seconds(el):
+    """
+    The elapsed seconds of an output.xml <status> element: Robot 7 writes 'elapsed', older versions
+    'starttime' and 'endtime'.
+    """
+    from datetime import datetime
+    if el.get('elapsed') is not None:
+        return float(el.get('elapsed'))
+    fmt = '%Y%m%d %H:%M:%S.%f'
+    try:
+        return (datetime.strptime(el.get('endtime'), fmt) - datetime.strptime(el.get('starttime'), fmt)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+def suite_durations(output):
+    """
+    Seconds each suite (file or directory) has taken, from a Robot output.xml (file name or file object).
+
+    >>> from io import StringIO
+    >>> xml = '''<robot><suite name="Top">
+    ...   <suite name="A" source="/t/a.robot"><status status="PASS" elapsed="12.5"/></suite>
+    ...   <suite name="C" source="/t/c"><status status="PASS" elapsed="3.0"/></suite>
+    ...   <suite name="B" source="/t/b.robot">
+    ...     <status status="FAIL" starttime="20240101 10:00:00.000" endtime="20240101 10:01:00.500"/></suite>
+    ...   <status status="FAIL" elapsed="73.0"/></suite></robot>'''
+    >>> sorted(suite_durations(StringIO(xml)).items())
+    [('/t/a.robot', 12.5), ('/t/b.robot', 60.5), ('/t/c', 3.0)]
+    """
+    import xml.etree.ElementTree as ET
+    res = {}
+    for suite in ET.parse(output).iter('suite'):
+        source = suite.get('source')
+        status = suite.find('status')
+        if source and status is not None:
+            t = _seconds(status)
+            if t is not None:
+                res[abspath(source)] = t
+    return res
+
+
+def worker_env(index, base=None):
+    """
+    The environment of a worker: its shard number, and its own trace file and agent port if those are set.
+
+    >>> e = worker_env(2, {'TRANSAS_UIA_TRACE': 'out/trace.json', 'TRANSAS_UIA_AGENT': '127.0.0.1:8271'})
+    >>> e[WORKER_ENV], e['TRANSAS_UIA_TRACE'], e['TRANSAS_UIA_AGENT']
+    ('2', 'out/trace.2.json', '127.0.0.1:8273')
+    """
+    env = dict(os.environ if base is None else base)
+    env[WORKER_ENV] = str(index)
+    trace = env.get('TRANSAS_UIA_TRACE')
+    if trace:
+        root, ext = os.path.splitext(trace)
+        env['TRANSAS_UIA_TRACE'] = '%s.%d%s' % (root, index, ext)
+    agent = env.get('TRANSAS_UIA_AGENT')
+    if agent:
+        host, _, port = agent.rpartition(':')
+        env['TRANSAS_UIA_AGENT'] = '%s:%d' % (host, int(port) + index)
+    return env
+
+
+def run(paths, workers, outputdir='results', robot_args=(), durations_file=None, python=sys.executable):
+    """
+    Runs the suites and merges the results into <outputdir>/output.xml (and log/report). Returns the exit
+    code of the merge (the number of failed tests, as robot's one), or 252 when a shard has produced no
+    output: its tests are missing from the results.
+    """
+    from impl._calibration import load_cache, update_cache
+    durations_file = durations_file or DURATIONS_FILE
+    durations = load_cache(durations_file)
+    suites = find_suites(paths)
+    if not suites:
+        raise SystemExit('No suites with tests in %s' % ', '.join(paths))
+    shards = balance(estimate(suites, durations), workers)
+    procs = []
+    for i, shard in enumerate(shards):
+        out = join(outputdir, 'shard%d' % i)
+        cmd = [python, '-m', 'robot', '--outputdir', out, '--output', 'output.xml', '--log', 'NONE',
+               '--report', 'NONE'] + list(robot_args) + shard
+        logging.warning('Shard %d: %d suite(s)' % (i, len(shard)))
+        procs.append((out, subprocess.Popen(cmd, env=worker_env(i))))
+    outputs = []
+    measured = {}
+    lost = 0
+    for out, p in procs:
+        p.wait()
+        output = join(out, 'output.xml')
+        if os.path.exists(output):
+            outputs.append(output)
+            measured.update(suite_durations(output))
+        else:
+            logging.error('Shard %s has produced no output (exit code %s)' % (out, p.returncode))
+            lost += 1
+    update_cache(durations_file, lambda c: c.update(measured))
+    if not outputs:
+        return 252
+    rc = subprocess.call([python, '-m', 'robot.rebot', '--outputdir', outputdir, '--output', 'output.xml']
+                         + outputs)
+    return 252 if lost else rc
+
+
+def main(argv):
+    import argparse
+    robot_args = []
+    if '--' in argv:
+        i = argv.index('--')
+        argv, robot_args = argv[:i], argv[i + 1:]
+    p = argparse.ArgumentParser(prog='python -m impl._shard', description='Sharded parallel Robot run')
+    p.add_argument('paths', nargs='+', help='.robot files or directories')
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    p.add_argument('--outputdir', default='results')
+    p.add_argument('--durations', help='the suite durations file (default: $TRANSAS_UIA_DURATIONS or %s)'
+                   % DURATIONS_FILE)
+    args = p.parse_args(argv)
+    return run(args.paths, args.workers, args.outputdir, robot_args, args.durations)
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,179 @@
+from impl._locator import compile_locator
+
+INDEXED = ('auto_id', 'control_id', 'control_type', 'title')
+
+
+class Node(object):
+    __slots__ = ('element', 'key', 'parent', 'children', 'title', 'control_type', 'auto_id', 'control_id')
+
+    def __init__(self, element, parent, props):
+        self.element = element
+        self.parent = parent
+        self.children = []
+        self.key, self.title, self.control_type, self.auto_id, self.control_id = props
+
+    def __repr__(self):
+        return 'Node(%r, %r, auto_id=%r)' % (self.title, self.control_type, self.auto_id)
+
+
+class Snapshot(object):
+    """
+    The properties of a window's whole subtree, fetched in one pass and indexed by auto_id, control_id,
+    control_type and title. `backend` gives children(element) and properties(element), the latter returns
+    (identity key, title, control_type, auto_id, control_id).
+
+    >>> from impl._fake_backend import FakeBackend, FakeControl
+    >>> b = FakeBackend()
+    >>> w = b.window(b.start('calc.exe'), 'Calculator')
+    >>> s = Snapshot(b, w)
+    >>> len(s), b.calls['properties']
+    (15, 15)
+    >>> [n.title for n in s.find(control_type='Button', title_re='[0-3]$')]
+    ['0', '1', '2', '3']
+    >>> s.find(auto_id='equalButton')[0].element.control_id, s.find(control_id='93')[0].title
+    (121, 'Plus')
+    >>> s.find(auto_id='equalButton', title='Plus')
+    []
+    >>> s.find(title='Calculator'), s.find(title_re='Calc.*'), len(s.find(title_re='.*'))
+    ([], [], 14)
+
+    A refresh reads the properties of the new controls only, and only under the given node:
+
+    >>> pad = w['Number pad']
+    >>> _ = pad.add(FakeControl('.', 'Button', auto_id='decimalSeparatorButton'))
+    >>> pad.window(title='0').wrapper_object().remove()
+    >>> s.refresh(s.find(title='Number pad')[0]), b.calls['properties']
+    ((1, 1), 16)
+    >>> [n.title for n in s.find(control_type='Button', title_re='[0-3.]$')]
+    ['1', '2', '3', '.']
+    >>> pad.window(title='1').wrapper_object().title = 'One'
+    >>> s.refresh(), [n.title for n in s.find(title='1')], b.calls['properties']
+    ((0, 0), ['1'], 16)
+    >>> s.refresh(properties=True), [n.auto_id for n in s.find(title='One')], b.calls['properties']
+    ((0, 0), ['num1Button'], 31)
+    """
+
+    def __init__(self, backend, window):
+        self.backend = backend
+        self.window = window
+        self.nodes = {}
+        self.indexes = dict((name, {}) for name in INDEXED)
+        self._order = None
+        self.root = self._add(backend.resolve(window), None)
+        self._walk(self.root, {})
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _add(self, element, parent):
+        node = Node(element, parent, self.backend.properties(element))
+        self.nodes[node.key] = node
+        self._index(node)
+        return node
+
+    def _index(self, node):
+        for name in INDEXED:
+            v = getattr(node, name)
+            if v is not None:
+                self.indexes[name].setdefault(str(v), []).append(node)
+
+    def _unindex(self, node):
+        for name in INDEXED:
+            v = getattr(node, name)
+            if v is not None:
+                bucket = self.indexes[name][str(v)]
+                bucket.remove(node)
+                if not bucket:
+                    del self.indexes[name][str(v)]
+
+    def _drop(self, node):
+        del self.nodes[node.key]
+        self._unindex(node)
+
+    def update(self, node):
+        """
+        Re-reads the properties of a known node and re-indexes it if they have changed (a renamed control, a
+        new text). Returns whether they have.
+        """
+        props = self.backend.properties(node.element)
+        if props[1:] == (node.title, node.control_type, node.auto_id, node.control_id):
+            return False
+        self._unindex(node)
+        _, node.title, node.control_type, node.auto_id, node.control_id = props
+        self._index(node)
+        return True
+
+    def _walk(self, node, old, properties=False):
+        """
+        Reads the children of the node and of its descendants. Nodes of `old` (by key) are reused, with
+        `properties` their properties are read again and re-indexed if they have changed.
+        """
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            children = []
+            for el in self.backend.children(n.element):
+                child = old.pop(self.backend.key(el), None)
+                if child is None:
+                    child = self._add(el, n)
+                else:
+                    child.element, child.parent = el, n
+                    child.children = []
+                    self.nodes[child.key] = child
+                    if properties:
+                        self.update(child)
+                children.append(child)
+            n.children = children
+            stack.extend(reversed(children))
+
+    def refresh(self, node=None, properties=False):
+        """
+        Re-reads the structure under the node (the whole window by default): the controls still there are kept
+        as they are, only the new ones have their properties read. With `properties`, those of the known
+        controls (the node included) are read again too, and re-indexed if they have changed. Returns
+        (added, removed) counts.
+        """
+        node = node or self.root
+        if properties:
+            self.update(node)
+        old = {}
+        stack = list(node.children)
+        while stack:
+            n = stack.pop()
+            old[n.key] = n
+            stack.extend(n.children)
+        before = len(self.nodes)
+        self._walk(node, old, properties)
+        added = len(self.nodes) - before
+        for n in old.values():
+            self._drop(n)
+        self._order = None
+        return added, len(old)
+
+    def find(self, title=None, title_re=None, control_id=None, auto_id=None, control_type=None):
+        """
+        Controls (the window itself excluded) matching all the given criteria, in the tree order. The smallest
+        index bucket is taken first, the compiled locator checks the rest.
+        """
+        locator = compile_locator({'title': title, 'title_re': title_re, 'control_id': control_id,
+                                   'auto_id': auto_id, 'control_type': control_type})
+        given = [(name, str(v)) for name, v in (('auto_id', auto_id), ('control_id', control_id),
+                                                ('control_type', control_type), ('title', title)) if v is not None]
+        if given:
+            buckets = [self.indexes[name].get(v, ()) for name, v in given]
+            nodes = min(buckets, key=len)
+            if len(locator.order) > 1:
+                nodes = locator.filter(nodes)
+        else:
+            nodes = locator.filter(self.nodes.values())
+        nodes = [n for n in nodes if n is not self.root]
+        if len(nodes) < 2:
+            return nodes
+        if self._order is None:
+            self._order = {}
+            stack = [self.root]
+            while stack:
+                n = stack.pop()
+                self._order[n] = len(self._order)
+                stack.extend(reversed(n.children))
+        return sorted(nodes, key=self._order.__getitem__)
@@ -0,0 +1,50 @@
+"""
+A stand-in crash monitor, for running the monitoring without the real one (on Linux, in the doctests). Takes
+the arguments of _errmon.py (exec_file test result_file); the test is the scripted behaviour:
+
+    ok                  beats until killed
+    crash@<seconds>     exits with 1 after so long
+    error@<seconds>     reports an error on the board after so long, and goes on beating
+    hang@<seconds>      stops beating after so long, without exiting
+    done@<seconds>      reports it has finished and exits with 0
+
+It beats on the board named by $TRANSAS_UIA_BOARD (slot $TRANSAS_UIA_BOARD_SLOT) every
+$TRANSAS_UIA_HEARTBEAT_INTERVAL seconds.
+"""
+import os
+import sys
+from time import monotonic, sleep
+
+if __package__ in (None, ''):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from impl._heartbeat import BEAT_INTERVAL, DONE, ERROR, OK, HeartbeatWriter
+
+
+def main(argv):
+    behaviour = argv[1] if len(argv) > 1 else 'ok'
+    fault, _, after = behaviour.partition('@')
+    fault_at = monotonic() + float(after or 0)
+    interval = float(os.environ.get('TRANSAS_UIA_HEARTBEAT_INTERVAL', BEAT_INTERVAL))
+    board = HeartbeatWriter.from_env()
+    status, errors = OK, 0
+    while True:
+        if fault != 'ok' and monotonic() >= fault_at:
+            if fault == 'crash':
+                return 1
+            if fault == 'hang':
+                while True:
+                    sleep(3600)
+            if fault == 'done':
+                if board:
+                    board.beat(DONE, errors)
+                return 0
+            if fault == 'error' and status != ERROR:
+                status, errors = ERROR, errors + 1
+        if board:
+            board.beat(status, errors)
+        sleep(interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
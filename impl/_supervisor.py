@@ -0,0 +1,272 @@
+import heapq
+import logging
+import os
+from itertools import count
+from threading import Condition, Event, Thread
+from time import monotonic
+
+import queue
+
+from impl import _clock
+
+POLL_INTERVAL = 0.05        # Where no child can be waited for as an event (no pidfd): how often they are polled
+
+
+class ChildWaiter(object):
+    """
+    Waits for the exit of any of many children at once, from one thread, and can be woken up by another
+    one. On Windows: a single WaitForMultipleObjects on the process handles and a wake-up event. On Linux:
+    one selector over a pidfd per child and a wake-up pipe. Elsewhere the children are polled every
+    POLL_INTERVAL while waiting on the pipe. os.waitpid(-1) is not used: it would also reap the children
+    started by others (the apps under test), behind the back of their Popen objects.
+
+    >>> import subprocess, sys
+    >>> for pidfd in (True, False):
+    ...     w = ChildWaiter(pidfd)
+    ...     p = subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(3)'])
+    ...     w.add(p)
+    ...     exited = []
+    ...     t0 = monotonic()
+    ...     while not exited and monotonic() - t0 < 30:
+    ...         exited = w.wait(5)
+    ...     print(exited == [p], p.returncode, w.wait(0))
+    ...     w.wake()
+    ...     print(w.wait(5))
+    ...     w.close()
+    True 3 []
+    []
+    True 3 []
+    []
+    """
+
+    def __init__(self, pidfd=True):
+        self.popens = {}            # Popen -> its pidfd (None when polled)
+        if os.name == 'nt':
+            import ctypes
+            self._kernel32 = ctypes.windll.kernel32
+            self._event = self._kernel32.CreateEventW(None, False, False, None)
+            self._selector = None
+        else:
+            import selectors
+            self._selector = selectors.DefaultSelector()
+            self._r, self._w = os.pipe()
+            os.set_blocking(self._r, False)
+            os.set_blocking(self._w, False)
+            self._selector.register(self._r, selectors.EVENT_READ)
+        self._pidfd = pidfd and hasattr(os, 'pidfd_open')
+
+    def add(self, popen):
+        fd = None
+        if self._selector is not None and self._pidfd:
+            import selectors
+            try:
+                fd = os.pidfd_open(popen.pid)
+            except ProcessLookupError:
+                pass                # Reaped already: poll() tells at the next wait
+            except OSError:
+                self._pidfd = False
+            else:
+                self._selector.register(fd, selectors.EVENT_READ, popen)
+        self.popens[popen] = fd
+
+    def _remove(self, popen):
+        fd = self.popens.pop(popen)
+        if fd is not None:
+            self._selector.unregister(fd)
+            os.close(fd)
+
+    def wake(self):
+        if self._selector is None:
+            self._kernel32.SetEvent(self._event)
+        else:
+            try:
+                os.write(self._w, b'.')
+            except BlockingIOError:
+                pass                # A wake-up is pending already
+
+    def wait(self, timeout=None):
+        """
+        Blocks until a child exits, wake() is called or the timeout (seconds, None = forever) expires. Returns
+        the Popens of the exited children (reaped, so their returncode is set); they are no longer watched.
+        """
+        if self._selector is None:
+            self._wait_windows(timeout)
+        else:
+            polled = any(fd is None for fd in self.popens.values())
+            if polled:
+                timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+            for key, _ in self._selector.select(timeout):
+                if key.fd == self._r:
+                    try:
+                        while os.read(self._r, 512):
+                            pass
+                    except BlockingIOError:
+                        pass
+        exited = [p for p in self.popens if p.poll() is not None]
+        for p in exited:
+            self._remove(p)
+        return exited
+
+    def _wait_windows(self, timeout):
+        import _winapi
+        handles = [self._event] + [int(p._handle) for p in self.popens]
+        ms = _winapi.INFINITE if timeout is None else int(timeout * 1000)
+        if len(handles) <= 64:          # MAXIMUM_WAIT_OBJECTS
+            _winapi.WaitForMultipleObjects(handles, False, ms)
+        else:
+            # More children than one wait can take: wait on the first ones, in slices, polling the others
+            _winapi.WaitForMultipleObjects(handles[:64], False, min(ms, int(POLL_INTERVAL * 1000)))
+
+    def close(self):
+        for p in list(self.popens):
+            self._remove(p)
+        if self._selector is None:
+            self._kernel32.CloseHandle(self._event)
+        else:
+            self._selector.close()
+            os.close(self._r)
+            os.close(self._w)
+
+
+class MonitorSupervisor(object):
+    """
+    Owns the crash monitor children. A single supervisor thread waits for the exit of all of them at once
+    (see ChildWaiter), counts failed exits and restarts the children with a backoff: `min_backoff` for a
+    child that lived longer than `max_backoff`, otherwise twice the previous backoff (up to `max_backoff`).
+    `errors` is a plain counter, so reading it costs nothing.
+
+    A monitor is any object with a start() method that spawns a child into its `popen` attribute, an `errors`
+    counter and a kill() method.
+
+    >>> import subprocess, sys, threading
+    >>> from time import sleep
+    >>> class Crasher(object):
+    ...     errors = 0
+    ...     popen = None
+    ...     def start(self):
+    ...         self.popen = subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(3)'])
+    ...     def kill(self):
+    ...         if self.popen and self.popen.poll() is None:
+    ...             self.popen.kill()
+    >>> threads = threading.active_count()
+    >>> s = MonitorSupervisor(min_backoff=0.01, max_backoff=0.05)
+    >>> crashers = [Crasher() for _ in range(4)]
+    >>> for c in crashers:
+    ...     s.add(c)
+    >>> threading.active_count() - threads
+    1
+    >>> t0 = monotonic()
+    >>> while s.errors < 8 and monotonic() - t0 < 30:
+    ...     sleep(0.01)
+    >>> s.stop()
+    >>> s.errors >= 8, sum(c.errors for c in crashers) == s.errors, s.restarts >= 8, s.running
+    (True, True, True, False)
+    """
+
+    def __init__(self, min_backoff=0.1, max_backoff=5.0, on_error=None):
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.on_error = on_error
+        self.errors = 0
+        self.restarts = 0
+        self._changed = Condition()
+        self.monitors = []
+        self._added = queue.Queue()
+        self._stopped = Event()
+        self._waiter = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add(self, monitor):
+        self.monitors.append(monitor)
+        if self._thread is None:
+            self._waiter = ChildWaiter()
+            self._thread = Thread(target=self._run, name='monitor-supervisor')
+            self._thread.daemon = True
+            self._thread.start()
+        self._added.put(monitor)
+        self._waiter.wake()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._waiter.wake()
+            self._thread.join()
+            self._waiter.close()
+        for m in self.monitors:
+            m.kill()
+        self.monitors = []
+
+    def count_error(self, monitor=None):
+        with self._changed:
+            if monitor is not None:
+                monitor.errors += 1
+            self.errors += 1
+            self._changed.notify_all()
+        if self.on_error:
+            self.on_error()
+
+    def wait_errors(self, known, timeout=None):
+        """
+        Blocks until the error counter differs from `known` or the timeout (seconds, None = forever) expires.
+        Returns the counter.
+
+        >>> s = MonitorSupervisor()
+        >>> s.wait_errors(0, 0.01)
+        0
+        >>> t = Thread(target=s.count_error)
+        >>> t.start()
+        >>> s.wait_errors(0, 30)
+        1
+        >>> t.join()
+        """
+        with self._changed:
+            _clock.CLOCK.wait_for(self._changed, lambda: self.errors != known, timeout)
+            return self.errors
+
+    def _spawn(self, monitor, running):
+        try:
+            monitor.start()
+        except Exception:
+            logging.exception('Cannot start a crash monitor')
+            return False
+        if monitor.popen is not None and monitor.popen not in running:
+            running[monitor.popen] = monitor, monotonic()
+            self._waiter.add(monitor.popen)
+        return True
+
+    def _run(self):
+        pending = []
+        backoffs = {}
+        running = {}        # Popen -> (monitor, started)
+        seq = count()
+        while True:
+            timeout = max(0.0, pending[0][0] - monotonic()) if pending else None
+            exited = self._waiter.wait(timeout)
+            if self._stopped.is_set():
+                return
+            while True:
+                try:
+                    monitor = self._added.get_nowait()
+                except queue.Empty:
+                    break
+                heapq.heappush(pending, (monotonic(), next(seq), monitor))
+            for popen in exited:
+                monitor, started = running.pop(popen)
+                if popen.returncode:
+                    self.count_error(monitor)
+                lived = monotonic() - started
+                backoff = self.min_backoff if lived >= self.max_backoff else \
+                    min(max(backoffs.get(monitor, 0.0) * 2, self.min_backoff), self.max_backoff)
+                backoffs[monitor] = backoff
+                self.restarts += 1
+                heapq.heappush(pending, (monotonic() + backoff, next(seq), monitor))
+            now = monotonic()
+            while pending and pending[0][0] <= now:
+                monitor = heapq.heappop(pending)[2]
+                if not self._spawn(monitor, running):
+                    backoffs[monitor] = self.max_backoff
+                    heapq.heappush(pending, (now + self.max_backoff, next(seq), monitor))
@@ -0,0 +1,136 @@
+import logging
+import os
+
+from impl import _clock
+from impl._parallel import parallel_map
+from impl._waiter import Waiter
+
+_psutil = None         # Imported on the first check, False when it is not installed
+
+
+def running_pids(pids):
+    """
+    Returns the subset of pids that are still running, checked in bulk, or None if there is no
+    bulk way to check on this system.
+
+    >>> running_pids([os.getpid()]) == set([os.getpid()])
+    True
+    """
+    global _psutil
+    if _psutil is None:
+        try:
+            import psutil as _psutil
+        except ImportError:
+            _psutil = False
+    pids = set(p for p in pids if p)
+    if _psutil:
+        return pids & set(_psutil.pids())
+    if os.name != 'posix':
+        return None
+    res = set()
+    for p in pids:
+        try:
+            os.kill(p, 0)
+        except ProcessLookupError:
+            continue
+        except PermissionError:
+            pass
+        res.add(p)
+    return res
+
+
+def _pid(app):
+    return getattr(app, 'process', None)
+
+
+def _alive(apps):
+    pids = running_pids(_pid(a) for a in apps)
+    res = []
+    for a in apps:
+        pid = _pid(a)
+        if pids is None or pid is None:
+            if a.is_process_running():
+                res.append(a)
+        elif pid in pids:
+            res.append(a)
+    return res
+
+
+def ask_to_exit(app):
+    """
+    Closes the top level windows of an app, which is a polite request to exit.
+    """
+    for w in app.windows():
+        try:
+            w.close()
+        except Exception:
+            pass
+
+
+class TeardownRecord(object):
+    __slots__ = ('app', 'pid', 'result', 'time')
+
+    def __init__(self, app):
+        self.app = app
+        self.pid = _pid(app)
+        self.result = 'not running'
+        self.time = 0.0
+
+    def __repr__(self):
+        return 'TeardownRecord(pid=%s, result=%r, time=%.3f)' % (self.pid, self.result, self.time)
+
+
+def teardown_apps(apps, grace, label='Teardown', ask=ask_to_exit, waiter=None):
+    """
+    Asks all the running apps to exit at once, waits for them until one shared `grace` deadline (seconds),
+    then kills the ones still running. Returns a TeardownRecord per app, in the order of the apps:
+    'not running', 'exited' or 'killed', with the time it took since the teardown started.
+
+    >>> class App(object):
+    ...     def __init__(self, pid, running, obeys):
+    ...         self.process, self.running, self.obeys = pid, running, obeys
+    ...     def is_process_running(self):
+    ...         return self.running
+    ...     def windows(self):
+    ...         return [self]
+    ...     def close(self):
+    ...         self.running = self.running and not self.obeys
+    ...     def kill(self):
+    ...         self.running = False
+    >>> apps = [App(None, False, True), App(None, True, True), App(None, True, False)]
+    >>> [r.result for r in teardown_apps(apps, 0.05)]
+    ['not running', 'exited', 'killed']
+    >>> any(a.running for a in apps)
+    False
+    """
+    now_f = _clock.CLOCK.now
+    t0 = now_f()
+    records = [TeardownRecord(a) for a in apps]
+    alive = _alive(apps)
+    if not alive:
+        return records
+    by_app = dict((id(r.app), r) for r in records)
+    for a in alive:
+        logging.warning('%s: an app is still running' % label)
+    parallel_map(ask, alive)
+    deadline = t0 + grace
+    waiter = waiter or Waiter()
+    pauses = waiter.pauses()
+    while True:
+        still = _alive(alive)
+        now = now_f()
+        still_ids = set(id(a) for a in still)
+        for a in alive:
+            if id(a) not in still_ids:
+                r = by_app[id(a)]
+                r.result, r.time = 'exited', now - t0
+        alive = still
+        if not alive or now >= deadline:
+            break
+        waiter.sleep(min(next(pauses), deadline - now))
+    for a, (_, e) in zip(alive, parallel_map(lambda a: a.kill(), alive)):
+        r = by_app[id(a)]
+        r.result, r.time = 'killed', now_f() - t0
+        if e is not None:
+            logging.warning('%s: failed to kill an app (pid %s): %s' % (label, r.pid, e))
+    return records
@@ -0,0 +1,121 @@
+import os
+from os.path import dirname
+from threading import get_ident
+from time import monotonic
+
+DEFAULT_CAPACITY = 1 << 16
+
+TRACER = None     # Hooks check it first, so a disabled tracing costs one global lookup
+
+
+class Tracer(object):
+    """
+    Spans (name, category, start, end on the monotonic clock, attributes) in a preallocated ring buffer: when
+    it is full the oldest spans are overwritten. flush() writes them as a Chrome trace (chrome://tracing,
+    Perfetto).
+
+    >>> t = Tracer(capacity=3)
+    >>> for i in range(4):
+    ...     t.record('kw%d' % i, 'keyword', i, i + 0.5)
+    >>> [e['name'] for e in t.events()], t.dropped
+    (['kw1', 'kw2', 'kw3'], 1)
+    >>> t.begin('Suite', 'suite', {'source': 'a.robot'})
+    >>> t.begin('Test', 'test')
+    >>> t.end({'status': 'PASS'})
+    >>> t.end()
+    >>> e = t.events()[-1]
+    >>> e['name'], e['ph'], e['dur'] >= 0, e['args']
+    ('Suite', 'X', True, {'source': 'a.robot'})
+    >>> t.events()[-2]['args']
+    {'status': 'PASS'}
+    """
+
+    def __init__(self, path=None, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self.t0 = monotonic()
+        self._names = [None] * capacity
+        self._cats = [None] * capacity
+        self._starts = [0.0] * capacity
+        self._ends = [0.0] * capacity
+        self._tids = [0] * capacity
+        self._args = [None] * capacity
+        self._stack = []
+
+    @property
+    def dropped(self):
+        return max(0, self.count - self.capacity)
+
+    def record(self, name, cat, start, end, args=None):
+        i = self.count % self.capacity
+        self.count += 1
+        self._names[i] = name
+        self._cats[i] = cat
+        self._starts[i] = start
+        self._ends[i] = end
+        self._tids[i] = get_ident()
+        self._args[i] = args
+
+    def begin(self, name, cat, args=None):
+        self._stack.append((name, cat, monotonic(), args))
+
+    def end(self, args=None):
+        if not self._stack:
+            return      # Tracing has started inside of the span
+        name, cat, start, a = self._stack.pop()
+        if args:
+            a = dict(a, **args) if a else args
+        self.record(name, cat, start, monotonic(), a)
+
+    def events(self):
+        n = min(self.count, self.capacity)
+        first = self.count - n
+        pid = os.getpid()
+        res = []
+        for j in range(first, self.count):
+            i = j % self.capacity
+            e = {'name': self._names[i], 'cat': self._cats[i], 'ph': 'X', 'pid': pid, 'tid': self._tids[i],
+                 'ts': (self._starts[i] - self.t0) * 1e6, 'dur': (self._ends[i] - self._starts[i]) * 1e6}
+            if self._args[i]:
+                e['args'] = self._args[i]
+            res.append(e)
+        return res
+
+    def flush(self, path=None):
+        """
+        Writes all the spans in the buffer (not only the new ones) into the file.
+        """
+        path = path or self.path
+        if not path:
+            return None
+        d = dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        import json
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped': self.dropped}}, f, default=repr)
+        return path
+
+
+def start_tracing(path, capacity=DEFAULT_CAPACITY):
+    global TRACER
+    TRACER = Tracer(path, capacity)
+    return TRACER
+
+
+def stop_tracing():
+    """
+    Flushes and disables the tracing. Returns the path of the trace file.
+    """
+    global TRACER
+    t, TRACER = TRACER, None
+    if t is not None:
+        return t.flush()
+
+
+def start_from_env():
+    path = os.environ.get('TRANSAS_UIA_TRACE')
+    if path and TRACER is None:
+        start_tracing(path)
@@ -1,7 +1,12 @@
-from time import time, clock, sleep
+from time import time, monotonic
 from os.path import dirname, abspath, basename, join
-import subprocess
+import logging
+import os
 import sys
+import threading
+
+from impl import _clock, _trace
+from impl._waiter import Waiter, WaitStats
 
 FASTER_COMPUTER = 1
 SLOW_COMPUTER = 3
@@ -18,7 +23,7 @@ class UserError(Exception):
 def get_function(seq):
     i = iter(seq)
     def fun():
-        return i.next()
+        return next(i)
     return fun
 
 #def error_decorator(f):
@@ -82,6 +87,7 @@ def assert_raises(exc, f, *a, **kw):
 def timing():
     print("timing")
     begin_time = time()
+    import subprocess
     p = subprocess.call('ipy test.py', shell=True)
     sum_time = time() - begin_time
     return sum_time
@@ -91,45 +97,35 @@ class Delay(object):
     FOREVER = 'forever'
     BENCHMARKED_FLAG = '~'
     BENCHMARK_INITIAL = False
-    BENCHMARK = VERY_SLOW_COMPUTER     #Lower is better (faster computer)
+    BENCHMARK = None     #Lower is better (faster computer), a continuous factor between FASTER_COMPUTER and VERY_SLOW_COMPUTER
     @classmethod
-    def do_benchmarking(cls, time_f=time):
+    def do_benchmarking(cls, calibrate_f=None):
         """
         >>> Delay.BENCHMARK=None
-        >>> Delay.do_benchmarking(get_function((0, FASTER_COMPUTER*0.5)))
+        >>> Delay.do_benchmarking(lambda lo, hi: lo)
         >>> Delay.BENCHMARK
         1
         >>> Delay.BENCHMARK=None
-        >>> Delay.do_benchmarking(get_function((FASTER_COMPUTER,SLOW_COMPUTER)))
+        >>> Delay.do_benchmarking(lambda lo, hi: 2.7)
+        >>> Delay.BENCHMARK
+        2.7
+        >>> Delay.do_benchmarking(lambda lo, hi: hi)
         >>> Delay.BENCHMARK
-        3
+        2.7
         >>> Delay.BENCHMARK=None
-        >>> Delay.do_benchmarking(get_function((0,FASTER_COMPUTER*5)))
+        >>> Delay.do_benchmarking(lambda lo, hi: hi)
         >>> Delay.BENCHMARK
         5
         >>> Delay.BENCHMARK=7
-        >>> Delay.do_benchmarking(get_function((0,FASTER_COMPUTER*5)))
+        >>> Delay.do_benchmarking(lambda lo, hi: lo)
         >>> Delay.BENCHMARK
         7
-        >>> Delay.BENCHMARK=None
-        >>> Delay.do_benchmarking(get_function((0,FASTER_COMPUTER*1.5)))
-        >>> Delay.BENCHMARK
-        3
-        >>> Delay.BENCHMARK=None
-        >>> Delay.do_benchmarking(get_function((0,0)))
-        >>> Delay.BENCHMARK
-        1
-    """
+        """
         if cls.BENCHMARK is None:
+            if calibrate_f is None:
+                from impl._calibration import calibrate as calibrate_f
             cls.BENCHMARK_INITIAL = True
-            cls.BENCHMARK = FASTER_COMPUTER
-            begin_time = time_f()
-            p = subprocess.call('ipy test.py', shell=True)
-            s_time = time_f() - begin_time
-            if s_time > SLOW_COMPUTER and s_time < VERY_SLOW_COMPUTER:
-               cls.BENCHMARK = SLOW_COMPUTER
-            if s_time > VERY_SLOW_COMPUTER:
-              cls.BENCHMARK = VERY_SLOW_COMPUTER
+            cls.BENCHMARK = calibrate_f(FASTER_COMPUTER, VERY_SLOW_COMPUTER)
 
     def __cmp__(self, sec):
         """
@@ -160,6 +156,7 @@ class Delay(object):
     def __init__(self, s):
         """
         >>> from math import fabs
+        >>> Delay.BENCHMARK = 2
         >>> assert fabs(Delay(' 10s ').value - 10) < 0.00001
         >>> assert fabs(Delay('10ms').value - 0.01) < 0.00001
         >>> assert_raises(IronbotException, Delay, '10ns')
@@ -185,6 +182,8 @@ class Delay(object):
 
         if s.startswith(self.BENCHMARKED_FLAG):
             s = s[len(self.BENCHMARKED_FLAG):]
+            if self.BENCHMARK is None:
+                self.do_benchmarking()
             k *= self.BENCHMARK
 
         try:
@@ -197,6 +196,10 @@ TIME_ACCURACY = 0.0001
 WAIT_GRANULARITY = 0.2
 
 MONITORING = None
+ERRMON_SCRIPT = os.environ.get('TRANSAS_UIA_ERRMON', join(dirname(abspath(__file__)), '_errmon.py'))
+HEARTBEAT_SCAN = 0.1      # How often the heartbeat board is scanned between the checks
+WAITER = Waiter(cap=WAIT_GRANULARITY)
+LAST_WAIT_STATS = None
 
 
 def set_monitoring(monitoring):
@@ -204,20 +207,97 @@ def set_monitoring(monitoring):
     MONITORING = monitoring
 
 
-def waiting_iterator(timeout):
-    t0 = clock()
-    first_loop = True
-    while first_loop or (timeout and timeout >= clock() - t0 - TIME_ACCURACY):
-        first_loop = False
+def set_waiter(waiter):
+    """
+    Replaces the default waiter used by waiting_iterator (e.g. with FixedWaiter(WAIT_GRANULARITY)).
+    """
+    global WAITER
+    WAITER = waiter
+
+
+def notify_change():
+    """
+    Wakes up the current waits, so they re-check their conditions without waiting for the pause to end.
+    """
+    WAITER.notify()
+
+
+def last_wait_stats():
+    return LAST_WAIT_STATS
+
+
+def waiting_iterator(timeout, waiter=None, stats=None):
+    """
+    Yields once per check until the timeout (a Delay, or None for a single check) expires. Pauses
+    between the checks are given by the waiter, the last one is cut to end exactly at the deadline.
+    Counters of the wait are collected into `stats` (also available as last_wait_stats()).
+
+    >>> len(list(waiting_iterator(None)))
+    1
+    >>> len(list(waiting_iterator(Delay('0s'))))
+    1
+    >>> s = WaitStats()
+    >>> t0 = monotonic()
+    >>> n = len(list(waiting_iterator(Delay('50ms'), stats=s)))
+    >>> 0.05 <= monotonic() - t0 < 0.5, n == s.iterations, 2 < n < 15
+    (True, True, True)
+    >>> last_wait_stats() is s
+    True
+    >>> for i, _ in enumerate(waiting_iterator(Delay('forever'))):
+    ...     if i == 3: break
+
+    In virtual time a long wait takes no real time:
+
+    >>> from impl._clock import VirtualClock, set_clock
+    >>> real = set_clock(VirtualClock())
+    >>> t0 = monotonic()
+    >>> s = WaitStats()
+    >>> n = len(list(waiting_iterator(Delay('10m'), stats=s)))
+    >>> monotonic() - t0 < 1, round(s.sleeping, 6) == 600 + TIME_ACCURACY
+    (True, True)
+    >>> _ = set_clock(real)
+    """
+    global LAST_WAIT_STATS
+    waiter = waiter or WAITER
+    if stats is None:
+        stats = WaitStats()
+    LAST_WAIT_STATS = stats
+    now = _clock.CLOCK.now
+    once = timeout is None or timeout.value == 0
+    deadline = None
+    if not once and timeout.value is not None:
+        deadline = now() + timeout.value + TIME_ACCURACY
+    pauses = waiter.pauses()
+    tracer = _trace.TRACER
+    started = monotonic()
+    try:
+        while True:
+            t = now()
+            if MONITORING:
+                MONITORING.check_monitors()
+            stats.iterations += 1
+            yield
+            t_checked = now()
+            stats.checking += t_checked - t
+            if once:
+                break
+            pause = next(pauses)
+            if deadline is not None:
+                if t_checked >= deadline:
+                    break
+                pause = min(pause, deadline - t_checked)
+            slept, woken = waiter.sleep(pause)
+            stats.sleeping += slept
+            if woken:
+                stats.wakeups += 1
+                pauses = waiter.pauses()
         if MONITORING:
             MONITORING.check_monitors()
-        yield
-        if timeout and timeout.value:
-            sleep(WAIT_GRANULARITY)
-    if timeout and timeout.value:
-        yield
-    if MONITORING:
-        MONITORING.check_monitors()
+    finally:
+        if tracer is not None:
+            tracer.record('wait', 'wait', started, monotonic(), {'iterations': stats.iterations,
+                          'sleeping': stats.sleeping, 'wakeups': stats.wakeups})
+
 
 def _negate(not_found, v):
     if not_found:
@@ -318,12 +398,73 @@ def result_modifier(res, src_list=None, not_found=False, any=False, all=False, s
     >>> result_modifier([1], src_list=1, index=0)
     (True, 1, None)
     """
-    def make_prefer_bool(ok, res, msg):
-        if prefer_bool:
-            res = ok
-        return ok, res, msg
+    flags = _modifier_flags(src_list, any, all, single, none, number, index)
+    filtered = [v for v in res if _negate(not_found, v)]
+    return _modify(res, filtered, prefer_bool, *flags)
+
+
+def stream_result_modifier(items, src_list=None, not_found=False, any=False, all=False, single=False, none=False,
+                           number=None, prefer_bool=False, index=None):
+    """
+    The same as result_modifier, but takes a lazy iterable (e.g. a generator fetching element properties)
+    and stops pulling items as soon as the outcome is known: 'any' and 'none' at the first match, 'single'
+    at the second one, 'index=n' at the (n+1)-th one, 'number=k' at the (k+1)-th one, 'all' at the first
+    mismatch. The list results and 'found N item(s)' counts then cover only the items pulled so far.
+
+    >>> cases = [[], [None], [1]]
+    >>> flags = [{'any': True}, {'all': True}, {'single': True}, {'none': True}, {'number': 0}, {'number': 1},
+    ...          {'index': 0}, {'single': True, 'none': True}, {'src_list': 1}, {'src_list': [1]}]
+    >>> for res in cases:
+    ...     for f in flags:
+    ...         for nf in (False, True):
+    ...             for pb in (False, True):
+    ...                 expected = result_modifier(res, not_found=nf, prefer_bool=pb, **f)
+    ...                 assert stream_result_modifier(iter(res), not_found=nf, prefer_bool=pb, **f) == expected
+    >>> pulled = []
+    >>> def items():
+    ...     for i in range(1000):
+    ...         pulled.append(i)
+    ...         yield i % 2
+    >>> stream_result_modifier(items(), any=True), len(pulled)
+    ((True, [0, 1], None), 2)
+    >>> del pulled[:]
+    >>> stream_result_modifier(items(), single=True), len(pulled)
+    ((False, [0, 1, 0, 1], "The result does not match 'single' flag, found 2 item(s)"), 4)
+    >>> del pulled[:]
+    >>> stream_result_modifier(items(), index=2), len(pulled)
+    ((True, 1, None), 6)
+    >>> del pulled[:]
+    >>> stream_result_modifier(items(), number=1, prefer_bool=True), len(pulled)
+    ((False, False, "The result does not match 'number' value, found 2 item(s)"), 4)
+    >>> del pulled[:]
+    >>> stream_result_modifier(items(), all=True), len(pulled)
+    ((False, [0], "The result does not match 'all' flag"), 1)
+    """
+    flags = _modifier_flags(src_list, any, all, single, none, number, index)
+    single, none, single_or_none = flags[2:5]
+    limit = None
+    if index is not None:
+        limit = index + 1
+    elif any or none:
+        limit = 1
+    elif single or single_or_none:
+        limit = 2
+    elif number is not None:
+        limit = number + 1
+    res = []
+    filtered = []
+    for v in items:
+        res.append(v)
+        if _negate(not_found, v):
+            filtered.append(v)
+            if limit is not None and len(filtered) >= limit:
+                break
+        elif all:
+            break
+    return _modify(res, filtered, prefer_bool, *flags)
 
 
+def _modifier_flags(src_list, any, all, single, none, number, index):
     single_or_none = not (isinstance(src_list, list) or src_list is None)
     initial_none = none
     initial_single = single
@@ -341,8 +482,16 @@ def result_modifier(res, src_list=None, not_found=False, any=False, all=False, s
 
     if len([v for v in (any, all, single, none, (number is not None), (index is not None)) if v]) > 1:
         raise IronbotException("'index' is incompatible with 'single', 'none', 'any', 'all' and 'number'")
+    return any, all, single, none, single_or_none, number, index, initial_single, initial_none
+
+
+def _modify(res, filtered, prefer_bool, any, all, single, none, single_or_none, number, index, initial_single,
+            initial_none):
+    def make_prefer_bool(ok, res, msg):
+        if prefer_bool:
+            res = ok
+        return ok, res, msg
 
-    filtered = [v for v in res if _negate(not_found, v)]
     if index is not None:
         if len(filtered) <= index:
             return make_prefer_bool(False, None, "Not enough items found for 'index' value")
@@ -378,84 +527,216 @@ def result_modifier(res, src_list=None, not_found=False, any=False, all=False, s
 
 class ErrorMonitor(object):
     """
+    Describes a crash monitor child. The child is started and restarted by a MonitorSupervisor.
+
     >>> em = ErrorMonitor('../../../tests/robot/errmon_01.robot', 'Errwnd_test', 'NONE')
+    >>> em.popen is None, em.errors
+    (True, 0)
     """
     errors = 0
+    script = ERRMON_SCRIPT
 
-    def __init__(self, exec_file, test, result_file):
+    def __init__(self, exec_file, test, result_file, board=None, slot=None):
         self.exec_file = exec_file
         self.result_file = result_file
         self.test = test
         self.popen = None
-        self.start()
+        self.board = board
+        self.slot = slot
+
+    def command(self):
+        return [sys.executable, self.script, self.exec_file, self.test, self.result_file]
 
     def start(self):
         if self.popen:
             if self.popen.poll() is None:
                 return False
             self.popen = None
-
-        #import logging
-        #logging.critical('' % ())
-        self.popen = subprocess.Popen([sys.executable, join(dirname(abspath(__file__)), '_errmon.py'),
-                                       self.exec_file, self.test, self.result_file])
+        import subprocess
+        env = None
+        if self.board is not None:
+            from impl._heartbeat import BOARD_ENV, SLOT_ENV
+            env = dict(os.environ)
+            env[BOARD_ENV], env[SLOT_ENV] = self.board, str(self.slot)
+        self.popen = subprocess.Popen(self.command(), env=env)
         return True
 
-    def check_state(self):
-        #import logging
-        #logging.error(repr(self.popen.poll()))
-        if self.popen.poll() is not None:
-            if self.popen.returncode:
-                self.errors += 1
-            self.start()
-
     def kill(self):
-        if self.popen and self.popen.poll():
+        if self.popen and self.popen.poll() is None:
             self.popen.kill()
-            self.popen = None
-
+        self.popen = None
 
 
 class Monitoring(object):
     errors = 0
+    finalization = None
 
-    def __init__(self, ft=Delay('30s'), ftt=Delay('1h')):
+    board = None
+
+    def __init__(self, ft=Delay('30s'), ftt=Delay('1h'), heartbeat_timeout=None):
+        from impl._supervisor import MonitorSupervisor
         self.monitors = []
+        self.supervisor = MonitorSupervisor(on_error=notify_change)
         self.FINALIZATION_TOTAL_TIMEOUT = ftt
         self.FINALIZATION_TIMEOUT = ft
+        self.heartbeat_timeout = heartbeat_timeout
+        self.faults = set()
+        self.detections = []
+        self._watch = None
+        self._board_lock = threading.Lock()
 
     def add_monitor(self, exec_file, test):
-        self.monitors.append(ErrorMonitor(exec_file, test, 'NONE'))
+        """
+        Starts a crash monitor with a slot on the heartbeat board: an error it reports there, or its heartbeat
+        missing for `heartbeat_timeout`, counts as an error like its crash. The board is scanned by
+        check_monitors() and every HEARTBEAT_SCAN by a watcher thread, so a fault is detected within
+        HEARTBEAT_SCAN (plus the timeout for a hang); `detections` has (monitor, kind, latency) of every fault.
+
+        >>> from time import sleep
+        >>> from impl import _standin_monitor
+        >>> real, ErrorMonitor.script = ErrorMonitor.script, _standin_monitor.__file__
+        >>> m = Monitoring(heartbeat_timeout=0.5)
+        >>> for behaviour in ('ok', 'error@0.3', 'hang@0.3', 'done@0.1'):
+        ...     m.add_monitor('standin', behaviour)
+        >>> t0 = monotonic()
+        >>> while len(m.detections) < 2 and monotonic() - t0 < 30:
+        ...     sleep(0.05)
+        >>> sorted((i, kind) for i, kind, _ in m.detections)
+        [(1, 'error'), (2, 'hung')]
+        >>> all(0 <= latency < 2 * HEARTBEAT_SCAN + 0.5 for _, _, latency in m.detections)
+        True
+        >>> try: m.check_monitors(False)
+        ... except IronbotException: print('raised')
+        >>> m.errors
+        2
+        >>> m.kill_monitors()
+        >>> ErrorMonitor.script = real
+        """
+        if self.board is None:
+            from impl._heartbeat import HeartbeatBoard, TIMEOUT
+            self.board = HeartbeatBoard()
+            self.heartbeat_timeout = self.heartbeat_timeout or TIMEOUT
+            self._watch_stop = threading.Event()
+            self._watch = threading.Thread(target=self._watch_board, name='heartbeat-watch', daemon=True)
+            self._watch.start()
+        with self._board_lock:
+            m = ErrorMonitor(exec_file, test, 'NONE', self.board.path, self.board.assign())
+            self.monitors.append(m)
+        self.supervisor.add(m)
+
+    def _watch_board(self):
+        while not self._watch_stop.wait(HEARTBEAT_SCAN):
+            try:
+                self.scan_board()
+            except Exception:
+                logging.exception('Scanning the heartbeat board has failed')
+
+    def scan_board(self):
+        """
+        Reads the heartbeat board once, counts the new faults as errors. A monitor that recovers (restarted
+        after hanging) is counted again at its next fault.
+        """
+        with self._board_lock:
+            board = self.board
+            if board is None:
+                return
+            now = monotonic()
+            faults = board.scan(self.heartbeat_timeout, now)
+            current = set()
+            for slot, kind, since in faults:
+                current.add(slot)
+                if slot not in self.faults:
+                    latency = max(0.0, now - since)
+                    self.detections.append((slot, kind, latency))
+                    logging.warning('Crash monitor %d (%s): %s, detected in %.3fs' % (
+                        slot, self.monitors[slot].test, 'reported an error' if kind == 'error' else 'hangs', latency))
+                    self.supervisor.count_error(self.monitors[slot])
+            self.faults = current
 
     def kill_monitors(self):
-        for m in self.monitors:
-            m.kill()
+        if self._watch is not None:
+            self._watch_stop.set()
+            self._watch.join()
+            self._watch = None
+        self.supervisor.stop()
+        with self._board_lock:
+            if self.board is not None:
+                self.board.close()
+                self.board = None
         self.monitors = []
 
     def check_monitors(self, finalize=True):
-        for m in self.monitors:
-            errs = m.errors
-            m.check_state()
-            if errs != m.errors:
-                self.errors += m.errors - errs
+        """
+        >>> m = Monitoring()
+        >>> m.check_monitors()
+        >>> m.supervisor.errors = 1
+        >>> try: m.check_monitors(False)
+        ... except IronbotException: print('raised')
+        >>> m.errors
+        1
+        """
+        tracer = _trace.TRACER
+        t0 = monotonic() if tracer is not None else 0
+        if self.board is not None:
+            self.scan_board()
+        self.errors = self.supervisor.errors
+        if tracer is not None:
+            tracer.record('check_monitors', 'monitor', t0, monotonic(), {'errors': self.errors})
         if self.errors and finalize:
             self.finalize_errors()
             raise IronbotException("Error monitors detected a crash...")
 
     def finalize_errors(self):
-        t_total = clock()
-        first_outer_loop = True
-        while first_outer_loop or (self.FINALIZATION_TOTAL_TIMEOUT and self.FINALIZATION_TOTAL_TIMEOUT >= clock() - t_total - TIME_ACCURACY):
-            t0 = clock()
-            first_loop = False
-            while first_loop or (self.FINALIZATION_TIMEOUT and self.FINALIZATION_TIMEOUT >= clock() - t0 - TIME_ACCURACY):
-                first_loop = False
-                old_errs = self.errors
-                self.check_monitors(False)
-                if old_errs != self.errors:
-                    t0 = clock()
-                if self.FINALIZATION_TIMEOUT and self.FINALIZATION_TIMEOUT.value:
-                    sleep(WAIT_GRANULARITY)
+        """
+        Collects the errors of the monitors still finishing their work: returns when no new error has come for
+        FINALIZATION_TIMEOUT, or when FINALIZATION_TOTAL_TIMEOUT is over. Waits on the monitors' exit events,
+        not by polling. Returns (seconds spent, errors collected), also kept in `finalization`.
+
+        >>> m = Monitoring(Delay('50ms'), Delay('10s'))
+        >>> t, errors = m.finalize_errors()
+        >>> 0.05 <= t < 1, errors
+        (True, 0)
+        >>> from threading import Timer
+        >>> Timer(0.03, m.supervisor.count_error).start()
+        >>> t, errors = m.finalize_errors()
+        >>> 0.08 <= t < 1, errors
+        (True, 1)
+        >>> m = Monitoring(Delay('forever'), Delay('50ms'))
+        >>> 0.05 <= m.finalize_errors()[0] < 1
+        True
+        >>> Monitoring(None, Delay('10s')).finalize_errors()[0] < 0.05
+        True
+        >>> from impl._clock import VirtualClock, set_clock
+        >>> clock = VirtualClock()
+        >>> real = set_clock(clock)
+        >>> m = Monitoring(Delay('30s'), Delay('1h'))
+        >>> for t in (10, 35, 60):
+        ...     clock.call_at(t, m.supervisor.count_error)
+        >>> m.finalize_errors()
+        (90.0, 3)
+        >>> Monitoring(Delay('forever'), Delay('1h')).finalize_errors()
+        (3600.0, 0)
+        >>> _ = set_clock(real)
+        """
+        quiet = self.FINALIZATION_TIMEOUT.value if self.FINALIZATION_TIMEOUT else 0
+        total = self.FINALIZATION_TOTAL_TIMEOUT.value if self.FINALIZATION_TOTAL_TIMEOUT else 0
+        clock = _clock.CLOCK
+        start = quiet_start = clock.now()
+        errors = self.supervisor.errors
+        while True:
+            ends = [t0 + d for t0, d in ((quiet_start, quiet), (start, total)) if d is not None]
+            end = min(ends) if ends else None
+            now = clock.now()
+            if end is not None and now >= end:
+                break
+            new = self.supervisor.wait_errors(errors, None if end is None else end - now)
+            if new != errors:
+                errors = new
+                quiet_start = clock.now()
+        self.errors = errors
+        self.finalization = clock.now() - start, errors
+        logging.warning('Crash monitors finalized in %.2fs, %d error(s) collected' % self.finalization)
+        return self.finalization
 
 
 def stop_monitoring():
@@ -0,0 +1,82 @@
+from threading import Event
+
+from impl import _clock
+
+
+class WaitStats(object):
+    """
+    Per-wait counters filled in by waiting_iterator.
+
+    >>> s = WaitStats()
+    >>> s.iterations, s.sleeping, s.checking, s.wakeups
+    (0, 0.0, 0.0, 0)
+    """
+    __slots__ = ('iterations', 'sleeping', 'checking', 'wakeups')
+
+    def __init__(self):
+        self.iterations = 0
+        self.sleeping = 0.0
+        self.checking = 0.0
+        self.wakeups = 0
+
+    def __repr__(self):
+        return 'WaitStats(iterations=%d, sleeping=%.4f, checking=%.4f, wakeups=%d)' % (
+            self.iterations, self.sleeping, self.checking, self.wakeups)
+
+
+class Waiter(object):
+    """
+    Sleeps between two checks of a waiting loop. The first pause is `initial` seconds, every next one
+    is `factor` times longer but never longer than `cap`. A condition source may call notify() to wake
+    the waiting thread up before the pause is over.
+
+    >>> w = Waiter(initial=0.005, factor=2, cap=0.02)
+    >>> p = w.pauses()
+    >>> [next(p) for _ in range(5)]
+    [0.005, 0.01, 0.02, 0.02, 0.02]
+    >>> w.notify()
+    >>> slept, woken = w.sleep(10)
+    >>> woken, slept < 1
+    (True, True)
+    >>> w.sleep(0.001)[1]
+    False
+    """
+
+    def __init__(self, initial=0.005, factor=2.0, cap=0.2):
+        self.initial = initial
+        self.factor = factor
+        self.cap = cap
+        self._event = Event()
+
+    def pauses(self):
+        pause = self.initial
+        while True:
+            yield pause
+            pause = min(pause * self.factor, self.cap)
+
+    def notify(self):
+        self._event.set()
+
+    def sleep(self, seconds):
+        """
+        Returns a tuple (time actually slept, whether the waiter was woken up by notify()).
+        """
+        clock = _clock.CLOCK
+        t0 = clock.now()
+        woken = clock.wait(self._event, seconds)
+        if woken:
+            self._event.clear()
+        return clock.now() - t0, woken
+
+
+class FixedWaiter(Waiter):
+    """
+    The old behaviour: always sleep the same `granularity`.
+
+    >>> p = FixedWaiter(0.2).pauses()
+    >>> [next(p) for _ in range(3)]
+    [0.2, 0.2, 0.2]
+    """
+
+    def __init__(self, granularity):
+        Waiter.__init__(self, granularity, 1.0, granularity)
@@ -1,8 +1,18 @@
 import logging
 import re
-from pywinauto.application import Application
+from time import monotonic
 
+from impl._actions import parse_actions
+from impl._app_pool import AppPool
+from impl._backend import get_backend, set_backend
+from impl import _history
+from impl._conditions import WaitCondition, wait_until
 from impl._params import fixed_val, parse, parse_re, robot_args, parse_bool, pop_menu_path, str_2_bool
+from impl._locator import LOCATORS, compile_locator
+from impl._lookup_cache import LookupCache
+from impl._parallel import parallel_map
+from impl._snapshot import Snapshot
+from impl._teardown import teardown_apps
 from impl._util import Delay, IronbotException, waiting_iterator, result_modifier, stop_monitoring, setup_monitoring
 
 
@@ -13,30 +23,62 @@ class PywinAutoCoreException(Exception):
 CONTROLLED_APPS = [] #None
 
 
+APP_POOLS = []       # Per suite: executable -> AppPool
+ACQUIRED = []        # Per test: (pool, app) pairs
+
+
 def on_enter_test():
     CONTROLLED_APPS.append([])
+    ACQUIRED.append([])
 
 
 def on_enter_suite():
     CONTROLLED_APPS.append([])
-    Delay.do_benchmarking()
+    APP_POOLS.append({})
 
 
-def on_leave_test():
-    for a in CONTROLLED_APPS[-1]:
-        if a.is_process_running():
-            logging.warning('Test teardown: an app is still running')
-            a.kill()
+TEARDOWN_GRACE = Delay('5s')
+LAST_TEARDOWN = []
+
+
+def _teardown(label):
+    global LAST_TEARDOWN
+    LAST_TEARDOWN = teardown_apps(CONTROLLED_APPS[-1], TEARDOWN_GRACE.value, label)
+    for r in LAST_TEARDOWN:
+        if r.result != 'not running':
+            logging.info('%s: app (pid %s) %s in %.2fs' % (label, r.pid, r.result, r.time))
     del CONTROLLED_APPS[-1]
+    LOOKUP_CACHE.invalidate()
+
+
+def on_leave_test():
+    for pool, app in ACQUIRED.pop():
+        pool.release(app)
+    _teardown('Test teardown')
     stop_monitoring()
 
 
 def on_leave_suite():
-    for a in CONTROLLED_APPS[-1]:
-        if a.is_process_running():
-            logging.warning('Suite teardown: an app is still running')
-            a.kill()
-    del CONTROLLED_APPS[-1]
+    for executable, pool in APP_POOLS.pop().items():
+        s = pool.stats()
+        logging.info('App pool %s: %d of %d acquisitions served warm (%.0f%%), %d recycled, ~%.1fs of launches '
+                     'saved' % (executable, s['hits'], s['hits'] + s['misses'], s['hit_rate'] * 100, s['recycled'],
+                                s['saved']))
+        pool.close()
+    _teardown('Suite teardown')
+    if _history.HISTORY:
+        _history.HISTORY.save()
+
+
+def _register_teardown(apps, teardown):
+    if teardown == 'test':
+        CONTROLLED_APPS[-1].extend(apps)
+    elif teardown == 'suite':
+        CONTROLLED_APPS[-2].extend(apps)
+
+
+def _failures_text(what, items, results):
+    return '; '.join("%s '%s': %s" % (what, i, e) for i, (_, e) in zip(items, results) if e is not None)
 
 
 LAUNCH_PARAMS = (
@@ -47,39 +89,41 @@ LAUNCH_PARAMS = (
        'workdir': ('workdir', parse),
        'failure_text': ('failure_text', parse),
        'backend': ('backend', parse),
+       'max_workers': ('max_workers', int),
     }
 )
 
 
 @robot_args(LAUNCH_PARAMS)
-def app_launch(executable, backend=None, teardown=None, params='', _assert=False, **kw):
+def app_launch(executable, backend=None, teardown=None, params='', _assert=False, max_workers=None, **kw):
     """
-    App Launch | <executable> [ | params | <cmdline parameters string> ] [ | flags and params ]
+    App Launch | <executable_or_executable_list> [ | params | <cmdline parameters string> ] [ | flags and params ]
 
     Launches an app. The first parameter is a path to the app's executable. Optional 'suite_teardown' or 'test_teardown'
     flags force to kill the app at the end of the suite or of the test, respectively (if still running).
     A 'params' named parameter is also optional, should be followed by a parameters string (all args in one).
+    If a list of executables is given, the apps are started concurrently (at most 'max_workers' at a time).
 
-    :return: An application object or None in case of failure if "assert" flag is not present.
+    :return: An application object or None in case of failure if "assert" flag is not present. A list of
+        them (in the order of the executables) if a list is given.
 
     """
-    try:
-        if backend is not None:
-            app = Application(backend=backend).start(executable)
-        else:
-            app = Application().start(executable)
-    except:
+    single = not isinstance(executable, list)
+    executables = [executable] if single else executable
+    results = parallel_map(lambda e: get_backend().start(e, backend), executables, max_workers)
+    apps = [app for app, e in results if e is None]
+    _register_teardown(apps, teardown)
+    failed = [e for _, e in results if e is not None]
+    if failed:
         if _assert:
             logging.error('Failed to launch an executable')
-            raise
-        logging.warning('Failed to launch an executable')
-        return None
-    if teardown == 'test':
-        CONTROLLED_APPS[-1].append(app)
-    elif teardown == 'suite':
-        CONTROLLED_APPS[-2].append(app)
-
-    return app
+            if single:
+                raise failed[0]
+            raise PywinAutoCoreException('Failed to launch: ' + _failures_text('executable', executables, results))
+        logging.warning('Failed to launch: ' + _failures_text('executable', executables, results))
+    if single:
+        return results[0][0]
+    return [app for app, _ in results]
 
 
 APP_ATTACH_PARAMS = (
@@ -87,18 +131,21 @@ APP_ATTACH_PARAMS = (
        'teardown': ('teardown', parse),
        'failure_text': ('failure_text', parse),
        'backend': ('backend', parse),
+       'max_workers': ('max_workers', int),
     }
 )
 
 
 @robot_args(APP_ATTACH_PARAMS)
-def app_attach(processes, backend=None, teardown=None):
+def app_attach(processes, backend=None, teardown=None, max_workers=None, **kw):
     """
     App Attach | <proc_or_proc_list> [ | test_teardown/suite_teardown ]
 
     Creates application objects for a process or for a list of processes. If test_teardown or
     suite_teardown is present, the applications are going to be terminated when the test (or
-    the suite) finishes.
+    the suite) finishes. A list of processes is connected to concurrently (at most 'max_workers'
+    at a time); if some of them fail, the others are still registered for the teardown and an
+    error listing every failed process is raised.
 
     :return: List of applications (if a list of processes is given) or an
         application (in case of a single process that is not wrapped into a list object).
@@ -107,21 +154,134 @@ def app_attach(processes, backend=None, teardown=None):
     single = not isinstance(processes, list)
     if single:
         processes = [processes]
-    if backend is not None:
-        apps = [Application(backend=backend).connect(process=p) for p in processes]
-    else:
-        apps = [Application().connect(process=p) for p in processes]
-    if teardown == 'test':
-        CONTROLLED_APPS[-1] += apps
-    elif teardown == 'suite':
-        CONTROLLED_APPS[-2] += apps
+    results = parallel_map(lambda p: get_backend().connect(p, backend), processes, max_workers)
+    apps = [app for app, e in results if e is None]
+    _register_teardown(apps, teardown)
+    if len(apps) != len(processes):
+        if single:
+            raise results[0][1]
+        raise PywinAutoCoreException('Failed to attach: ' + _failures_text('process', processes, results))
     if single:
         return apps[0]
     return apps
 
 
+APP_POOL_PARAMS = (
+    (parse,), {
+       'size': ('size', int),
+       'reset': ('reset', parse),
+       'backend': ('backend', parse),
+       'max_workers': ('max_workers', int),
+    }
+)
+
+
+def _reset_keyword(reset):
+    if reset is None or callable(reset):
+        return reset
+
+    def run(app):
+        from robot.libraries.BuiltIn import BuiltIn
+        BuiltIn().run_keyword(reset, app)
+    return run
+
+
+@robot_args(APP_POOL_PARAMS)
+def app_pool(executable, size=1, reset=None, backend=None, max_workers=None):
+    """
+    App Pool | <executable> [ | size | <n> ] [ | reset | <keyword> ] [ | backend | <backend> ]
+
+    Launches 'size' instances of the app at once for the current suite (call it from the Suite Setup); the
+    tests then take them with App Acquire instead of launching their own. An instance goes back to the pool
+    when its test ends, and is brought to a known state by the 'reset' keyword (called with the app) before
+    the next test gets it. An instance that has exited or fails the reset is killed, and a new one is launched
+    when the pool runs short. The instances are killed with the suite's teardown; the pool hit rate and the
+    launch time saved are logged.
+
+    :return: The number of the instances launched.
+    """
+    b = get_backend()
+    suite_apps = CONTROLLED_APPS[-2] if ACQUIRED else CONTROLLED_APPS[-1]
+
+    def launch():
+        app = b.start(executable, backend)
+        suite_apps.append(app)
+        return app
+
+    def discard(app):
+        if app in suite_apps:
+            suite_apps.remove(app)
+        teardown_apps([app], TEARDOWN_GRACE.value, 'App pool')
+
+    pool = AppPool(launch, size, _reset_keyword(reset), lambda app: app.is_process_running(), discard, max_workers)
+    APP_POOLS[-1][executable] = pool
+    return pool.fill()
+
+
+def _find_pool(executable):
+    for pools in reversed(APP_POOLS):
+        if executable in pools:
+            return pools[executable]
+    raise PywinAutoCoreException("No app pool for '%s', create it with App Pool" % executable)
+
+
+def app_acquire(executable):
+    """
+    App Acquire | <executable>
+
+    Takes an instance of the app from the pool of the suite (see App Pool) for the current test, launching a
+    new one if none is idle.
+
+    :return: An application object.
+    """
+    pool = _find_pool(executable)
+    app = pool.acquire()
+    ACQUIRED[-1].append((pool, app))
+    return app
+
+
+def app_pool_stats(executable):
+    """
+    App Pool Stats | <executable>
+
+    :return: A dictionary: 'hits', 'misses', 'recycled', 'launches', 'idle', 'hit_rate', 'launch_time' and
+        'saved' (the estimated seconds of launches avoided).
+    """
+    return _find_pool(executable).stats()
+
+
+LOOKUP_CACHE = LookupCache()
+
+
+def _lookup(parent, criteria_key, spec, handle=None):
+    b = get_backend()
+    key = (b.handle(parent) if handle is None else handle), criteria_key
+    return key, LOOKUP_CACHE.get(key, lambda: b.resolve(spec()), b.alive)
+
+
 def wnd_get(parent, wnd_name):
-    return parent[wnd_name]
+    return get_backend().window(parent, wnd_name)
+
+
+def _act(window, criteria, action, handle=None, parent=None):
+    b = get_backend()
+    locator = compile_locator(criteria)
+    criteria = locator.criteria
+    if isinstance(window, Snapshot):
+        return action(_snapshot_element(window, criteria))
+    find = lambda: b.find(window if parent is None else parent(), **criteria)
+    key, el = _lookup(window, locator.key, find, handle)
+    try:
+        return action(el)
+    except Exception:
+        if b.alive(el):
+            raise
+        LOOKUP_CACHE.discard(key)
+        return action(_lookup(window, locator.key, find, handle)[1])
+
+
+def _click(window, **criteria):
+    _act(window, criteria, get_backend().click)
 
 
 CLICK_BUTTON_PARAMS = (
@@ -137,13 +297,329 @@ CLICK_BUTTON_PARAMS = (
 @robot_args(CLICK_BUTTON_PARAMS)
 def click_button(window, title=None, title_re=None, control_id=None, auto_id=None):
     if title is not None:
-        window.window(title=title, control_type="Button").click()
+        _click(window, title=title, control_type="Button")
     elif title_re is not None:
-        window.window(title_re=title_re, control_type="Button").click()
+        _click(window, title_re=title_re, control_type="Button")
     elif control_id is not None:
-        window.window(control_id=control_id, control_type="Button").click()
+        _click(window, control_id=control_id, control_type="Button")
     elif auto_id is not None:
-        window.window(auto_id=auto_id, control_type="Button").click()
+        _click(window, auto_id=auto_id, control_type="Button")
+
+
+def _snapshot_element(snapshot, criteria):
+    b = snapshot.backend
+    nodes = snapshot.find(**criteria)
+    if nodes and not b.alive(nodes[0].element):
+        # Gone: only the subtree of its closest living ancestor is read again
+        node = nodes[0].parent
+        while node.parent is not None and not b.alive(node.element):
+            node = node.parent
+        snapshot.refresh(node)
+        nodes = snapshot.find(**criteria)
+    if not nodes:
+        snapshot.refresh()
+        nodes = snapshot.find(**criteria)
+    if not nodes:
+        # Maybe a known control has changed (renamed): the last resort before failing
+        snapshot.refresh(properties=True)
+        nodes = snapshot.find(**criteria)
+    if not nodes:
+        raise PywinAutoCoreException('No control matches %r' % criteria)
+    return nodes[0].element
+
+
+def wnd_snapshot(window):
+    """
+    Wnd Snapshot | <window>
+
+    Reads the properties of all the controls of a window in one pass and indexes them by auto_id, control_id,
+    control_type and title. The snapshot can be given to Click Button, Find Control and Verify Control instead
+    of the window: locators are then resolved without walking the UI tree. When the control found has
+    disappeared, the snapshot reads again the part of the tree it was in; when none matches, the new controls
+    of the whole window, then the properties of the known ones. Refresh Snapshot does the latter explicitly.
+
+    :return: A snapshot object.
+    """
+    return Snapshot(get_backend(), window)
+
+
+def refresh_snapshot(snapshot):
+    """
+    Refresh Snapshot | <snapshot>
+
+    Reads again the structure of the window and the properties of all its controls.
+
+    :return: A list of two numbers: controls added and removed since the last refresh.
+    """
+    return list(snapshot.refresh(properties=True))
+
+
+FIND_CONTROL_PARAMS = (
+    (parse,), {
+       'title': ('title', parse),
+       'title_re': ('title_re', parse),
+       'control_id': ('control_id', parse),
+       'auto_id': ('auto_id', parse),
+       'control_type': ('control_type', parse),
+    }
+)
+
+
+def _find_nodes(window, criteria):
+    if not isinstance(window, Snapshot):
+        window = Snapshot(get_backend(), window)
+    return window.find(**criteria)
+
+
+@robot_args(FIND_CONTROL_PARAMS)
+def find_control(window, **criteria):
+    """
+    Find Control | <window_or_snapshot> [ | title | <title> ] [ | title_re | <regexp> ] [ | control_id | <id> ]
+        [ | auto_id | <id> ] [ | control_type | <type> ]
+
+    :return: A list of the controls matching all the given criteria, in the tree order.
+    """
+    return [n.element for n in _find_nodes(window, criteria)]
+
+
+VERIFY_CONTROL_PARAMS = (
+    (parse,), dict(FIND_CONTROL_PARAMS[1], **{
+       'any': ('any', parse_bool),
+       'none': ('none', parse_bool),
+       'single': ('single', parse_bool),
+       'number': ('number', int),
+    })
+)
+
+
+@robot_args(VERIFY_CONTROL_PARAMS)
+def verify_control(window, any=False, none=False, single=False, number=None, **criteria):
+    """
+    Verify Control | <window_or_snapshot> | <criteria as in Find Control> [ | any/none/single | yes ] [ | number | <n> ]
+
+    Fails unless the controls matching the criteria satisfy the flag ('any' if none is given).
+
+    :return: The matching controls (a single control with 'single').
+    """
+    if not (none or single or number is not None):
+        any = True
+    ok, res, msg = result_modifier([n.element for n in _find_nodes(window, criteria)], any=any, none=none,
+                                   single=single, number=number)
+    if not ok:
+        raise PywinAutoCoreException('%s: %r' % (msg, criteria))
+    return res
+
+
+CONTROL_CONDITION_PARAMS = (
+    (parse,), dict(FIND_CONTROL_PARAMS[1], **{
+       'name': ('name', parse),
+       'enabled': ('enabled', parse_bool),
+       'not_found': ('not_found', parse_bool),
+       'any': ('any', parse_bool),
+       'all': ('all', parse_bool),
+       'none': ('none', parse_bool),
+       'single': ('single', parse_bool),
+       'number': ('number', int),
+       'index': ('index', int),
+    })
+)
+
+
+@robot_args(CONTROL_CONDITION_PARAMS)
+def control_condition(window, name=None, enabled=None, not_found=False, any=False, all=False, none=False,
+                      single=False, number=None, index=None, **criteria):
+    """
+    Control Condition | <window_or_snapshot> | <criteria as in Find Control> [ | name | <name> ]
+        [ | enabled | yes/no ] [ | any/all/single/none | yes ] [ | number/index | <n> ]
+
+    A condition for Wait Until All / Wait Until Any: the controls of the window matching the criteria (or,
+    with 'enabled', whether each of them is enabled or disabled) checked against the flag ('any' if none is
+    given). The controls are looked up again on every check; in a snapshot, which reads the window again only
+    when none is found or one of those found has disappeared.
+
+    :return: A condition object.
+    """
+    b = get_backend()
+    criteria = compile_locator(criteria).criteria
+    flags = dict(not_found=not_found, any=any, all=all, none=none, single=single, number=number, index=index)
+    if not (all or none or single or number is not None or index is not None):
+        flags['any'] = True
+
+    def check():
+        if isinstance(window, Snapshot):
+            found = [n.element for n in window.find(**criteria)]
+            if not found or not all(b.alive(el) for el in found):
+                window.refresh()
+                found = [n.element for n in window.find(**criteria)]
+        else:
+            found = b.find_all(window, **criteria)
+        if enabled is None:
+            return found
+        return [b.enabled(el) == enabled for el in found]
+    return WaitCondition(check, name or ', '.join('%s=%s' % kv for kv in sorted(criteria.items())), **flags)
+
+
+def _wait_until(timeout, conditions, require_all):
+    if not isinstance(timeout, Delay):
+        timeout = Delay(timeout)
+    history = _history.get_history()
+    key = _history.key(' & '.join(sorted(c.name for c in conditions)))
+    learned = history.timeout(key, timeout.value)
+    if learned != timeout.value:
+        logging.info('Learned timeout %.2fs instead of %.2fs' % (learned, timeout.value))
+        try:
+            report = wait_until(conditions, Delay('%rs' % learned), require_all)
+        except IronbotException as e:
+            raise IronbotException('%s (learned timeout %.2fs, written %.2fs)' % (e, learned, timeout.value))
+    else:
+        report = wait_until(conditions, timeout, require_all)
+    history.record(key, report.elapsed)
+    if report.slowest:
+        logging.info('Slowest condition to settle: %s (%.2fs)' % report.slowest)
+    return report
+
+
+def wait_until_all(timeout, *conditions):
+    """
+    Wait Until All | <timeout> | <condition> [ | <condition> ... ]
+
+    Waits until all the conditions (see Control Condition) are satisfied, checking them in one polling loop.
+    A satisfied condition is not checked again.
+
+    :return: A report: 'settled' maps the condition names to the seconds they took, 'slowest' is the
+        (name, seconds) of the last one to settle.
+    """
+    return _wait_until(timeout, conditions, True)
+
+
+def wait_until_any(timeout, *conditions):
+    """
+    Wait Until Any | <timeout> | <condition> [ | <condition> ... ]
+
+    Waits until at least one of the conditions is satisfied.
+
+    :return: A report, as Wait Until All does.
+    """
+    return _wait_until(timeout, conditions, False)
+
+
+class ActionFailed(PywinAutoCoreException):
+    def __init__(self, message, index, steps):
+        PywinAutoCoreException.__init__(self, message)
+        self.index = index
+        self.steps = steps
+
+
+def run_actions(window, *script):
+    """
+    Run Actions | <window_or_snapshot> | <action> | <params> [ | <action> | <params> ... ]
+
+    Runs a sequence of actions in one keyword call, the window is resolved once for all of them:
+
+        click | <locator>
+        type | <locator> | <text>
+        menu | <item> | <item> ... | <END>
+
+    A locator is title=..., title_re=..., control_id=... or auto_id=... The script may also be given as a
+    single list. Stops at the first failing step with an error naming its index (counted from 0).
+
+    :return: A list with a dictionary per step: 'index', 'action', 'target' and 'seconds' it took.
+    """
+    b = get_backend()
+    steps = parse_actions(script)
+    if isinstance(window, Snapshot):
+        handle = parent = None
+    else:
+        handle = b.handle(window)
+        resolved = [b.resolve(window)]
+
+        def parent():
+            # The window found once for the batch, found again only if it has gone
+            if not b.alive(resolved[0]):
+                resolved[0] = b.resolve(window)
+            return resolved[0]
+    report = []
+    for i, (action, target, text) in enumerate(steps):
+        t0 = monotonic()
+        try:
+            if action == 'menu':
+                b.select_menu(window.window if parent is None else parent(), target)
+            elif action == 'click':
+                _act(window, target, b.click, handle, parent)
+            else:
+                _act(window, target, lambda el: b.type_text(el, text), handle, parent)
+        except Exception as e:
+            report.append({'index': i, 'action': action, 'target': target, 'seconds': monotonic() - t0,
+                           'error': str(e)})
+            raise ActionFailed('Step %d (%s %s) failed: %s' % (i, action, target, e), i, report)
+        report.append({'index': i, 'action': action, 'target': target, 'seconds': monotonic() - t0})
+    return report
+
+
+def invalidate_lookup_cache(window=None):
+    """
+    Invalidate Lookup Cache [ | <window> ]
+
+    Forgets the controls found by the keywords in the given window (or everywhere), e.g. after a big UI
+    transition. Not required for correctness: a cached control that has disappeared is looked up again.
+
+    :return: The number of forgotten controls.
+    """
+    if window is None:
+        return LOOKUP_CACHE.invalidate()
+    return LOOKUP_CACHE.invalidate(get_backend().handle(window))
+
+
+def lookup_cache_stats():
+    """
+    Lookup Cache Stats
+
+    :return: A dictionary with the 'hits', 'misses', 'stale', 'evictions' counters and the current 'size'
+        of the control lookup cache.
+    """
+    return LOOKUP_CACHE.stats()
+
+
+def set_adaptive_timeouts(enabled, percentile=None, margin=None):
+    """
+    Set Adaptive Timeouts | <yes/no> [ | <percentile> [ | <margin> ] ]
+
+    Wait Until All / Wait Until Any record the seconds their conditions took to be satisfied, per suite,
+    calling keyword and conditions, in $TRANSAS_UIA_HISTORY (~/.transas_uia/wait_history.json by default).
+    When adaptive timeouts are on (also with $TRANSAS_UIA_ADAPTIVE_TIMEOUTS=1), a wait with enough history
+    times out after the given percentile (0.99 by default) of its durations times the margin (2 by default):
+    never later than the written timeout, so a failing test fails fast.
+    """
+    history = _history.get_history()
+    history.adaptive = parse_bool(enabled) if isinstance(enabled, str) else bool(enabled)
+    if percentile is not None:
+        history.q = float(percentile)
+    if margin is not None:
+        history.margin = float(margin)
+
+
+def locator_cache_stats():
+    """
+    Locator Cache Stats
+
+    Locators (title, title_re, control_id, auto_id, control_type and their combinations) are compiled once
+    into matchers that check the most selective criterion first; the compiled ones and the title_re patterns
+    are kept in a bounded cache.
+
+    :return: A dictionary with the 'hits', 'misses', 'evictions' counters, the number of compiled locators
+        ('size') and of compiled patterns ('patterns').
+    """
+    return LOCATORS.stats()
+
+
+def set_ui_backend(name):
+    """
+    Set Ui Backend | <pywinauto_or_fake>
+
+    Selects the engine the keywords drive: 'pywinauto' (the default, or $TRANSAS_UIA_BACKEND) or 'fake',
+    an in-memory simulation used for benchmarking the keyword layer off Windows.
+    """
+    set_backend(name)
 
 
 if __name__ == "__main__":